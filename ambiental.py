@@ -0,0 +1,414 @@
+import os
+import sys
+import math
+import time
+import uuid
+import threading
+from array import array
+from datetime import datetime, timezone
+from db import supabase_admin
+
+try:
+    import numpy as np  # Opcional: rollups vectorizados
+except ImportError:
+    np = None
+
+# ==========================================
+#  HUMEDAD Y TEMPERATURA (SENSORES DE LAS SALAS)
+# ==========================================
+# Las lecturas llegan por lotes y se guardan en un buffer circular por sensor
+# respaldado por arreglos contiguos (numpy o array.array), no por objetos.
+# Cada lote se agrega por bucket de 1 min / 1 h / 1 día (n, suma, min, max)
+# con operaciones vectorizadas. Un único hilo por proceso envía en bloque lo
+# acumulado desde el último envío a la función ambiental_merge_rollups, que lo
+# SUMA a la fila existente (n y suma se suman, min/max con least/greatest):
+# si las lecturas de un sensor llegan a varios workers, cada uno aporta su
+# parte y ninguno pisa al otro. Cada bloque lleva un id de lote y la función
+# ignora los lotes repetidos, así que reintentar tras un timeout no duplica.
+# Las gráficas se sirven de esos rollups (un año a nivel diario son ~365
+# filas por sensor) más lo que aún no se envió. Esquema: SCHEMA_SQL, o
+# `python ambiental.py schema`.
+
+LEVELS = (('1m', 60), ('1h', 3600), ('1d', 86400))
+LEVEL_SECONDS = dict(LEVELS)
+FIELDS = ('temp', 'hum')
+ROLLUP_TABLE = 'ambiental_rollups'
+ROLLUP_COLUMNS = "sensor_id, nivel, inicio, temp_n, temp_sum, temp_min, temp_max, temp_mean, hum_n, hum_sum, hum_min, hum_max, hum_mean"
+MERGE_FUNCTION = 'ambiental_merge_rollups'
+MAX_FUTURE = 300  # segundos: lecturas con el reloj adelantado se descartan
+# Fechas plausibles (2000-01-01 a 2100-01-01): fuera de eso es un reloj sin
+# sincronizar o basura, y ni siquiera se puede pasar a ISO
+MIN_TS = 946684800.0
+MAX_TS = 4102444800.0
+MERGE_CHUNK = 500
+
+SCHEMA_SQL = """
+create table ambiental_rollups (
+  sensor_id text not null, nivel text not null, inicio timestamptz not null,
+  temp_n int not null default 0, temp_sum float8 not null default 0, temp_min float8, temp_max float8,
+  hum_n int not null default 0, hum_sum float8 not null default 0, hum_min float8, hum_max float8,
+  temp_mean float8 generated always as (temp_sum / nullif(temp_n, 0)) stored,
+  hum_mean float8 generated always as (hum_sum / nullif(hum_n, 0)) stored,
+  primary key (sensor_id, nivel, inicio)
+);
+create table ambiental_lotes (id uuid primary key, creado timestamptz not null default now());
+
+create or replace function ambiental_merge_rollups(lote uuid, filas jsonb) returns void
+language plpgsql as $$
+begin
+  insert into ambiental_lotes (id) values (lote) on conflict do nothing;
+  if not found then return; end if;  -- reintento de un lote ya aplicado
+  delete from ambiental_lotes where creado < now() - interval '1 day';
+  insert into ambiental_rollups as r
+    (sensor_id, nivel, inicio, temp_n, temp_sum, temp_min, temp_max, hum_n, hum_sum, hum_min, hum_max)
+  select f.sensor_id, f.nivel, f.inicio, f.temp_n, f.temp_sum, f.temp_min, f.temp_max,
+         f.hum_n, f.hum_sum, f.hum_min, f.hum_max
+  from jsonb_populate_recordset(null::ambiental_rollups, filas) f
+  on conflict (sensor_id, nivel, inicio) do update set
+    temp_n = r.temp_n + excluded.temp_n, temp_sum = r.temp_sum + excluded.temp_sum,
+    temp_min = least(r.temp_min, excluded.temp_min), temp_max = greatest(r.temp_max, excluded.temp_max),
+    hum_n = r.hum_n + excluded.hum_n, hum_sum = r.hum_sum + excluded.hum_sum,
+    hum_min = least(r.hum_min, excluded.hum_min), hum_max = greatest(r.hum_max, excluded.hum_max);
+end $$;
+"""
+
+# Bucket: [inicio, temp_n, temp_sum, temp_min, temp_max, hum_n, hum_sum, hum_min, hum_max]
+# (min/max en NaN si el campo no vino en ninguna lectura del bucket)
+NAN = float('nan')
+
+def _fmin(a, b): return b if a != a else (a if b != b else min(a, b))
+def _fmax(a, b): return b if a != a else (a if b != b else max(a, b))
+
+def _merge(a, b):
+    """Suma el bucket b en a (mismo inicio)."""
+    for i in (1, 5):
+        a[i] += b[i]
+        a[i + 1] += b[i + 1]
+        a[i + 2] = _fmin(a[i + 2], b[i + 2])
+        a[i + 3] = _fmax(a[i + 3], b[i + 3])
+
+def parse_ts(value):
+    """Epoch en segundos (número) o ISO 8601 -> epoch float. Lanza ValueError."""
+    if isinstance(value, bool): raise ValueError("Fecha inválida")
+    try: ts = float(value)  # epoch (número o texto de la query string)
+    except (TypeError, ValueError):
+        dt = datetime.fromisoformat(str(value))
+        if dt.tzinfo is None: dt = dt.replace(tzinfo=timezone.utc)
+        ts = dt.timestamp()
+    if not MIN_TS <= ts <= MAX_TS: raise ValueError(f"Fecha fuera de rango: {value}")
+    return ts
+
+def parse_value(value):
+    """Lectura numérica; vacía o no finita -> NaN (campo ausente)."""
+    if value is None or value == '': return NAN
+    value = float(value)
+    return value if math.isfinite(value) else NAN
+
+def _iso(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat()
+
+# --- AGREGACIÓN POR BUCKETS ---
+def _aggregate_np(ts, values, width):
+    """ts ordenado; values (2, n). Devuelve lista de buckets en orden."""
+    starts = np.floor(ts / width) * width
+    idx = np.flatnonzero(np.r_[True, starts[1:] != starts[:-1]])
+    cols = [starts[idx]]
+    for v in values:
+        valid = ~np.isnan(v)
+        cols += [np.add.reduceat(valid.astype(np.float64), idx),
+                 np.add.reduceat(np.where(valid, v, 0.0), idx),
+                 np.fmin.reduceat(v, idx),
+                 np.fmax.reduceat(v, idx)]
+    return np.column_stack(cols).tolist()
+
+def _aggregate_py(ts, values, width):
+    out = []
+    current = None
+    for i, t in enumerate(ts):
+        start = math.floor(t / width) * width
+        if current is None or current[0] != start:
+            current = [start, 0.0, 0.0, NAN, NAN, 0.0, 0.0, NAN, NAN]
+            out.append(current)
+        for base, v in ((1, values[0][i]), (5, values[1][i])):
+            if v != v: continue
+            current[base] += 1
+            current[base + 1] += v
+            current[base + 2] = _fmin(current[base + 2], v)
+            current[base + 3] = _fmax(current[base + 3], v)
+    return out
+
+
+class RingBuffer:
+    """Últimas 'capacity' lecturas de un sensor en arreglos contiguos."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        if np is not None:
+            self.ts = np.zeros(capacity, dtype=np.float64)
+            self.values = np.full((2, capacity), np.nan, dtype=np.float32)
+        else:
+            self.ts = array('d', bytes(8 * capacity))
+            self.values = [array('f', bytes(4 * capacity)) for _ in FIELDS]
+        self.head = 0  # próxima posición a escribir
+        self.size = 0
+
+    def extend(self, ts, values):
+        n = len(ts)
+        if n > self.capacity:
+            ts, values, n = ts[-self.capacity:], [v[-self.capacity:] for v in values], self.capacity
+        if np is not None:
+            pos = (self.head + np.arange(n)) % self.capacity
+            self.ts[pos] = ts
+            self.values[:, pos] = values
+        else:
+            for i in range(n):
+                p = (self.head + i) % self.capacity
+                self.ts[p] = ts[i]
+                self.values[0][p] = values[0][i]
+                self.values[1][p] = values[1][i]
+        self.head = (self.head + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+
+    def since(self, t0):
+        """(ts, temp, hum) en orden cronológico con ts >= t0, como listas."""
+        k = self.size
+        if np is not None:
+            pos = (self.head - k + np.arange(k)) % self.capacity
+            ts = self.ts[pos]
+            mask = ts >= t0
+            return ts[mask].tolist(), self.values[0, pos][mask].tolist(), self.values[1, pos][mask].tolist()
+        out = ([], [], [])
+        for i in range(k):
+            p = (self.head - k + i) % self.capacity
+            if self.ts[p] >= t0:
+                out[0].append(self.ts[p])
+                out[1].append(self.values[0][p])
+                out[2].append(self.values[1][p])
+        return out
+
+
+def _from_row(r):
+    """Fila de ambiental_rollups -> bucket en memoria."""
+    b = [parse_ts(r['inicio'])]
+    for name in FIELDS:
+        n = r.get(f"{name}_n") or 0
+        total = r.get(f"{name}_sum")
+        if total is None: total = (r.get(f"{name}_mean") or 0.0) * n
+        b += [n, total,
+              NAN if r.get(f"{name}_min") is None else r[f"{name}_min"],
+              NAN if r.get(f"{name}_max") is None else r[f"{name}_max"]]
+    return b
+
+
+class _Sensor:
+    __slots__ = ('buffer', 'horizon', 'last', 'lecturas')
+
+    def __init__(self):
+        self.buffer = None  # RingBuffer: se crea con la primera lectura de este proceso
+        self.horizon = -math.inf  # inicio del último minuto recibido
+        self.last = None  # (ts, temp, hum)
+        self.lecturas = 0
+
+
+class AmbientalStore:
+    def __init__(self, raw_capacity=86400, max_sensors=200, flush_interval=5.0):
+        self.raw_capacity = raw_capacity
+        self.max_sensors = max_sensors
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._sensors = {}
+        self._delta = {}       # (sensor, nivel, inicio) -> bucket acumulado sin enviar
+        self._retry = []       # (lote, filas) que fallaron: se reenvían con el mismo id
+        self._pid = None
+        self.aceptadas = 0
+        self.descartadas = 0
+        self.filas_escritas = 0
+
+    def _ensure_started(self):
+        if self._pid == os.getpid(): return
+        with self._lock:
+            if self._pid == os.getpid(): return
+            # Tras un fork el hilo del padre no existe en el hijo
+            threading.Thread(target=self._run, name="ambiental-rollups", daemon=True).start()
+            self._pid = os.getpid()
+
+    # --- INGESTA ---
+    def ingest(self, sensor_id, ts, temp, hum):
+        """Agrega un lote de un sensor. Devuelve (aceptadas, descartadas)."""
+        self._ensure_started()
+        n = len(ts)
+        if np is not None:
+            ts = np.asarray(ts, dtype=np.float64)
+            values = np.array([temp, hum], dtype=np.float64)
+            if n > 1 and np.any(ts[1:] < ts[:-1]):
+                order = np.argsort(ts, kind='stable')
+                ts, values = ts[order], values[:, order]
+        else:
+            order = sorted(range(n), key=ts.__getitem__)
+            ts = [ts[i] for i in order]
+            values = [[temp[i] for i in order], [hum[i] for i in order]]
+
+        with self._lock:
+            sensor = self._sensors.get(sensor_id)
+            if sensor is None:
+                if len(self._sensors) >= self.max_sensors: raise ValueError("Demasiados sensores registrados")
+                sensor = self._sensors[sensor_id] = _Sensor()
+            # Solo se aceptan lecturas desde el último minuto recibido: lo
+            # atrasado suele ser un reenvío del gateway y se contaría dos veces
+            lo = max(sensor.horizon, MIN_TS)
+            hi = time.time() + MAX_FUTURE
+            if np is not None:
+                keep = (ts >= lo) & (ts <= hi)
+                if not keep.all(): ts, values = ts[keep], values[:, keep]
+                kept = len(ts)
+            else:
+                idx = [i for i, t in enumerate(ts) if lo <= t <= hi]
+                if len(idx) != n:
+                    ts = [ts[i] for i in idx]
+                    values = [[values[0][i] for i in idx], [values[1][i] for i in idx]]
+                kept = len(ts)
+            self.aceptadas += kept
+            self.descartadas += n - kept
+            if not kept: return 0, n
+
+            if sensor.buffer is None: sensor.buffer = RingBuffer(self.raw_capacity)
+            sensor.buffer.extend(ts, values)
+            sensor.lecturas += kept
+            sensor.last = (float(ts[-1]), float(values[0][-1]), float(values[1][-1]))
+            sensor.horizon = math.floor(sensor.last[0] / 60) * 60
+            aggregate = _aggregate_np if np is not None else _aggregate_py
+            for level, width in LEVELS:
+                for b in aggregate(ts, values, width):
+                    key = (sensor_id, level, b[0])
+                    current = self._delta.get(key)
+                    if current is None: self._delta[key] = b
+                    else: _merge(current, b)
+            return kept, n - kept
+
+    # --- PERSISTENCIA EN BLOQUE ---
+    @staticmethod
+    def _row(sensor_id, level, b):
+        """Bucket -> fila (con suma para la función y media para las gráficas)."""
+        row = {"sensor_id": sensor_id, "nivel": level, "inicio": _iso(b[0])}
+        for name, base in zip(FIELDS, (1, 5)):
+            n = int(b[base])
+            row[f"{name}_n"] = n
+            row[f"{name}_sum"] = b[base + 1]
+            row[f"{name}_min"] = b[base + 2] if n else None
+            row[f"{name}_max"] = b[base + 3] if n else None
+            row[f"{name}_mean"] = round(b[base + 1] / n, 4) if n else None
+        return row
+
+    def flush(self):
+        """Envía lo acumulado a la función de merge. Devuelve filas enviadas."""
+        with self._lock:
+            # Las filas se arman antes de vaciar nada: si algo falla aquí, lo
+            # pendiente sigue en _delta y _retry para el siguiente ciclo
+            rows = [self._row(*key[:2], b) for key, b in self._delta.items()]
+            self._delta = {}
+            batches, self._retry = self._retry, []
+        for r in rows: r.pop('temp_mean'), r.pop('hum_mean')
+        batches += [(str(uuid.uuid4()), rows[i:i + MERGE_CHUNK]) for i in range(0, len(rows), MERGE_CHUNK)]
+        sent = 0
+        for n, (lote, chunk) in enumerate(batches):
+            try:
+                supabase_admin.rpc(MERGE_FUNCTION, {"lote": lote, "filas": chunk}).execute()
+            except Exception:
+                # Mismo id de lote en el reintento: si sí se aplicó, la función lo ignora
+                with self._lock: self._retry = batches[n:] + self._retry
+                raise
+            sent += len(chunk)
+            self.filas_escritas += len(chunk)
+        return sent
+
+    def _run(self):
+        self._resume()
+        while True:
+            time.sleep(self.flush_interval)
+            try: self.flush()
+            except Exception as e: print(f"Error persistiendo rollups ambientales: {e}")
+
+    def _resume(self):
+        """Registra los sensores con datos de hoy (tras un reinicio u otro worker).
+
+        Los buckets no hace falta recuperarlos: la función suma sobre lo que
+        ya está en la tabla.
+        """
+        start = math.floor(time.time() / 86400) * 86400
+        try:
+            rows = supabase_admin.table(ROLLUP_TABLE).select('sensor_id') \
+                .eq('nivel', '1d').gte('inicio', _iso(start)).execute().data
+            with self._lock:
+                for r in rows:
+                    if r['sensor_id'] in self._sensors or len(self._sensors) >= self.max_sensors: continue
+                    self._sensors[r['sensor_id']] = _Sensor()
+        except Exception as e:
+            print(f"Error recuperando sensores ambientales: {e}")
+
+    # --- LECTURA ---
+    def sensors(self):
+        with self._lock:
+            return [{"sensor_id": sid, "lecturas": s.lecturas,
+                     "ultima": None if s.last is None else {
+                         "ts": _iso(s.last[0]),
+                         "temperatura": None if s.last[1] != s.last[1] else round(s.last[1], 2),
+                         "humedad": None if s.last[2] != s.last[2] else round(s.last[2], 2)}}
+                    for sid, s in sorted(self._sensors.items())]
+
+    def raw(self, sensor_id, since):
+        with self._lock:
+            sensor = self._sensors.get(sensor_id)
+            if sensor is None or sensor.buffer is None: return [], [], []
+            return sensor.buffer.since(since)
+
+    def pending(self, sensor_id, level):
+        """Buckets de este proceso aún no enviados, por inicio."""
+        with self._lock:
+            out = {}
+            for (sid, lvl, start), b in self._delta.items():
+                if sid == sensor_id and lvl == level: out[start] = list(b)
+            for _, rows in self._retry:
+                for r in rows:
+                    if r['sensor_id'] != sensor_id or r['nivel'] != level: continue
+                    b = _from_row(r)
+                    if b[0] in out: _merge(out[b[0]], b)
+                    else: out[b[0]] = b
+            return out
+
+    def series(self, sensor_id, level, desde, hasta):
+        """Rollups persistidos entre desde y hasta (epoch) + lo aún no enviado."""
+        rows = supabase_admin.table(ROLLUP_TABLE).select(ROLLUP_COLUMNS) \
+            .eq('sensor_id', sensor_id).eq('nivel', level) \
+            .gte('inicio', _iso(desde)).lt('inicio', _iso(hasta)).order('inicio').execute().data
+        merged = {parse_ts(r['inicio']): r for r in rows}
+        # Lo pendiente es un aporte más: se suma a lo persistido, no lo reemplaza
+        for start, b in self.pending(sensor_id, level).items():
+            if not desde <= start < hasta: continue
+            if start in merged: _merge(b, _from_row(merged[start]))
+            merged[start] = self._row(sensor_id, level, b)
+        return [merged[k] for k in sorted(merged)]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sensores": len(self._sensors),
+                "aceptadas": self.aceptadas,
+                "descartadas": self.descartadas,
+                "buckets_pendientes": len(self._delta) + sum(len(rows) for _, rows in self._retry),
+                "filas_escritas": self.filas_escritas,
+                "numpy": np is not None,
+            }
+
+
+store = AmbientalStore(
+    raw_capacity=int(os.getenv('AMBIENTAL_RAW_CAPACITY', 86400)),
+    max_sensors=int(os.getenv('AMBIENTAL_MAX_SENSORS', 200)),
+    flush_interval=float(os.getenv('AMBIENTAL_FLUSH_SECONDS', 5)),
+)
+
+
+if __name__ == '__main__':
+    # Esquema de las tablas y la función de merge: python ambiental.py schema
+    if sys.argv[1:] != ['schema']:
+        sys.exit("Uso: python ambiental.py schema")
+    print(SCHEMA_SQL.strip())
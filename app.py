@@ -1,30 +1,101 @@
-from flask import Flask, redirect, url_for
+from flask import Flask, redirect, url_for, jsonify
 import os
 from dotenv import load_dotenv
-from helpers import render_page
+from werkzeug.middleware.proxy_fix import ProxyFix
+import metrics
+import assets
+from helpers import render_page, login_required, profile_cache
+from mailer import outbox
+from rollups import rollup, RollupNotReady
+from notifications import digest
+from busqueda import despachos_index
+from eventos import feed
+from ambiental import store as ambiental_store
 
 # Importar los "Blueprints"
 from routes.auth import auth_bp
 from routes.admin import admin_bp
 from routes.despachos import despachos_bp
+from routes.ambiental import ambiental_bp
 
 load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY', 'clave_super_secreta')
 
+# Detrás de un proxy inverso: número de saltos en X-Forwarded-For en los que
+# se confía (0 = conexión directa, remote_addr es el cliente)
+PROXY_HOPS = int(os.getenv('PROXY_FIX_X_FOR', 0))
+if PROXY_HOPS: app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS)
+
+# Latencias por endpoint, llamadas a Supabase/SMTP y /metrics (Prometheus)
+metrics.init_app(app)
+
+# Estáticos con hash en el nombre, gzip/brotli y caché immutable
+assets.init_app(app)
+
+@metrics.register_collector
+def _app_stats():
+    p = profile_cache.stats()
+    m = outbox.stats()
+    s = despachos_index.stats()
+    f = feed.stats()
+    a = ambiental_store.stats()
+    return [
+        ('sgil_profile_cache_hits_total', 'counter', 'Aciertos de la caché de perfiles', p['hits']),
+        ('sgil_profile_cache_misses_total', 'counter', 'Fallos de la caché de perfiles', p['misses']),
+        ('sgil_profile_cache_size', 'gauge', 'Perfiles en caché', p['size']),
+        ('sgil_mail_queue_depth', 'gauge', 'Correos pendientes en el spool', m['queue_depth']),
+        ('sgil_mail_sent_total', 'counter', 'Correos enviados', m['sent']),
+        ('sgil_mail_failed_total', 'counter', 'Correos descartados tras reintentos', m['failed']),
+        ('sgil_mail_retries_total', 'counter', 'Reintentos de envío', m['retries']),
+        ('sgil_search_index_docs', 'gauge', 'Despachos en el índice de búsqueda', s['despachos']),
+        ('sgil_search_index_terms', 'gauge', 'Términos en el índice de búsqueda', s['terminos']),
+        ('sgil_feed_clients', 'gauge', 'Dashboards conectados al feed SSE', f['clientes']),
+        ('sgil_feed_events_total', 'counter', 'Eventos publicados en el feed SSE', f['eventos']),
+        ('sgil_ambiental_readings_total', 'counter', 'Lecturas de sensores aceptadas', a['aceptadas']),
+        ('sgil_ambiental_dropped_total', 'counter', 'Lecturas de sensores descartadas', a['descartadas']),
+        ('sgil_ambiental_pending_buckets', 'gauge', 'Rollups ambientales sin persistir', a['buckets_pendientes']),
+    ]
+
 # Registrar los Blueprints
 app.register_blueprint(auth_bp)
 app.register_blueprint(admin_bp)
 app.register_blueprint(despachos_bp)
+app.register_blueprint(ambiental_bp)
+
+# --- SERVICIOS EN SEGUNDO PLANO (UNA VEZ POR PROCESO, TRAS EL FORK) ---
+_servicios_pid = None
+
+def iniciar_servicios():
+    """Arranca los hilos de fondo de este proceso (idempotente por PID).
+
+    Corre en la primera petición de cada worker, ya después del fork; un
+    hook post_fork del servidor puede llamarla directamente.
+    """
+    global _servicios_pid
+    if _servicios_pid == os.getpid(): return
+    _servicios_pid = os.getpid()
+    # Correos que quedaron en el spool de un arranque anterior
+    outbox.start()
+    # Reanudar el resumen de logística pendiente (si el modo digest está activo)
+    if digest.enabled: digest.resume()
+    # Índice de búsqueda de despachos: se construye en segundo plano
+    if os.getenv('SEARCH_INDEX_AT_STARTUP', '1').lower() in ('1', 'true', 'yes'): despachos_index.start()
+    # Contadores del resumen: primer recorrido de la tabla en segundo plano
+    rollup.start()
+
+@app.before_request
+def _servicios_del_proceso():
+    if _servicios_pid != os.getpid(): iniciar_servicios()
 
 # --- RUTAS DE PLACEHOLDER ---
 # AQUÍ ESTABA EL ERROR: Faltaba 'calibracion' y 'clientes'
 rutas_faltantes = [
     'dosis_altas', 'relecturas', 'solicitudes', 'flujo_dosimetrico',
-    'humedad_temperatura', 'indicadores_operativos', 'certificados_lcd',
+    'certificados_lcd',
     'indicadores_tecnicos', 'gestion_documental', 'indicadores',
-    'indicadores_logisticos', 'actividad', 'niveles_investigacion',
+    'actividad', 'niveles_investigacion',
     'calibracion', 'clientes' 
 ]
 
@@ -36,11 +107,41 @@ for ruta in rutas_faltantes:
     # Creamos la ruta
     app.add_url_rule(url_path, endpoint_name, lambda: render_page('base.html'))
 
-# API dummy para el dashboard
+# --- RESUMEN E INDICADORES (ROLLUPS EN MEMORIA) ---
 @app.route('/api/dashboard/summary', methods=['GET'])
+@login_required
 def api_dashboard_summary():
-    from flask import jsonify
-    return jsonify({"dosis_altas_pendientes": 0, "solicitudes_pendientes": 0})
+    try:
+        return jsonify({"dosis_altas_pendientes": 0, **rollup.summary()})
+    except RollupNotReady as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
+    except Exception as e:
+        print(f"Error resumen dashboard: {e}")
+        return jsonify({"error": str(e)}), 500
+
+def _render_indicadores(tipo, titulo):
+    aviso = None
+    try:
+        resumen = rollup.summary()
+    except RollupNotReady as e:
+        aviso = str(e)
+    except Exception as e:
+        print(f"Error indicadores: {e}")
+        aviso = "No se pudieron cargar los indicadores"
+    if aviso:
+        resumen = {"solicitudes_pendientes": None, "total_despachos": None, "por_estado": {},
+                   "por_dia": {}, "items_por_cliente": {}}
+    return render_page('indicadores.html', tipo=tipo, titulo=titulo, resumen=resumen, aviso=aviso)
+
+@app.route('/indicadores-operativos')
+@login_required
+def indicadores_operativos():
+    return _render_indicadores('operativos', 'Indicadores Operativos')
+
+@app.route('/indicadores-logisticos')
+@login_required
+def indicadores_logisticos():
+    return _render_indicadores('logisticos', 'Indicadores Logísticos')
 
 # Redirección inicial
 @app.route('/')
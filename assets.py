@@ -0,0 +1,124 @@
+import os
+import sys
+import gzip
+import json
+import hashlib
+import mimetypes
+from flask import request, send_file
+
+try:
+    import brotli  # Opcional: variante .br
+except ImportError:
+    brotli = None
+
+# ==========================================
+#  ESTÁTICOS CON HUELLA Y PRECOMPRIMIDOS
+# ==========================================
+# Al arrancar (o con `python assets.py` en el build) cada archivo de static/
+# se copia a ASSETS_BUILD_DIR con el hash de su contenido en el nombre
+# (css/layout.css -> css/layout.3f2a1b9c0d12.css), junto con sus variantes
+# .gz y .br (esta última solo si el paquete 'brotli' está instalado).
+# url_for('static', ...) genera los nombres con hash, y esos se sirven con
+# Cache-Control immutable de un año y ETag fuerte: en visitas repetidas el
+# navegador no vuelve a pedirlos. Las rutas sin hash (p. ej. el logo
+# enlazado desde los correos) se siguen sirviendo como siempre.
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BUILD_DIR = os.getenv('ASSETS_BUILD_DIR', os.path.join(ROOT, 'static_build'))
+ENABLED = os.getenv('ASSETS_FINGERPRINT', '1').lower() in ('1', 'true', 'yes')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt', '.html', '.map')
+MIN_COMPRESS = 256  # bytes: por debajo la cabecera gzip cuesta más de lo que ahorra
+
+_manifest = {}  # ruta original -> ruta con hash
+_entries = {}   # ruta con hash -> {"etag", "mimetype", "encodings"}
+
+def _hashed_name(rel, digest):
+    base, ext = os.path.splitext(rel)
+    return f"{base}.{digest[:12]}{ext}"
+
+def _write(path, data):
+    # tmp + replace: varios workers pueden construir a la vez sin pisarse
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as fh: fh.write(data)
+    os.replace(tmp, path)
+
+def build(static_dir, build_dir=BUILD_DIR):
+    """Genera copias con hash y variantes comprimidas. Devuelve el manifiesto."""
+    manifest, entries = {}, {}
+    for dirpath, _, files in os.walk(static_dir):
+        for name in sorted(files):
+            src = os.path.join(dirpath, name)
+            rel = os.path.relpath(src, static_dir).replace(os.sep, '/')
+            with open(src, 'rb') as fh: data = fh.read()
+            digest = hashlib.sha256(data).hexdigest()
+            hashed = _hashed_name(rel, digest)
+            dest = os.path.join(build_dir, hashed)
+            encodings = []
+            # El nombre depende del contenido: si ya existe, ya está al día
+            if not os.path.exists(dest): _write(dest, data)
+            if rel.endswith(COMPRESSIBLE) and len(data) >= MIN_COMPRESS:
+                variants = [('gzip', '.gz', lambda d: gzip.compress(d, 9, mtime=0))]
+                if brotli is not None: variants.insert(0, ('br', '.br', lambda d: brotli.compress(d, quality=11)))
+                for encoding, suffix, compress in variants:
+                    if not os.path.exists(dest + suffix):
+                        packed = compress(data)
+                        if len(packed) >= len(data): continue
+                        _write(dest + suffix, packed)
+                    encodings.append(encoding)
+            manifest[rel] = hashed
+            entries[hashed] = {
+                "etag": digest,
+                "mimetype": mimetypes.guess_type(rel)[0] or 'application/octet-stream',
+                "encodings": encodings,
+            }
+    _write(os.path.join(build_dir, 'manifest.json'), json.dumps(manifest, indent=2).encode())
+    return manifest, entries
+
+_SUFFIX = {'br': '.br', 'gzip': '.gz'}
+
+def _negotiate(entry):
+    """Mejor variante disponible según Accept-Encoding (br > gzip > identidad)."""
+    for encoding in entry['encodings']:
+        if request.accept_encodings[encoding] > 0: return encoding
+    return None
+
+def init_app(app):
+    if not ENABLED or not app.static_folder: return
+    try:
+        manifest, entries = build(app.static_folder)
+    except OSError as e:
+        print(f"Error generando estáticos con huella (se sirven sin hash): {e}")
+        return
+    _manifest.update(manifest)
+    _entries.update(entries)
+    plain_static = app.view_functions['static']
+
+    @app.url_defaults
+    def _fingerprint(endpoint, values):
+        if endpoint == 'static' and 'filename' in values:
+            values['filename'] = _manifest.get(values['filename'], values['filename'])
+
+    def serve_static(filename):
+        entry = _entries.get(filename)
+        if entry is None: return plain_static(filename=filename)
+        encoding = _negotiate(entry)
+        path = os.path.join(BUILD_DIR, filename) + (_SUFFIX[encoding] if encoding else '')
+        # ETag fuerte distinto por codificación (bytes distintos)
+        etag = f"{entry['etag']}.{encoding}" if encoding else entry['etag']
+        response = send_file(path, mimetype=entry['mimetype'], etag=etag, conditional=True)
+        response.headers['Cache-Control'] = IMMUTABLE
+        if encoding: response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        return response
+
+    app.view_functions['static'] = serve_static
+
+
+if __name__ == '__main__':
+    # Build previo al despliegue: python assets.py [static_dir] [build_dir]
+    static_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(ROOT, 'static')
+    manifest, entries = build(static_dir, sys.argv[2] if len(sys.argv) > 2 else BUILD_DIR)
+    for rel, hashed in manifest.items():
+        print(f"{rel} -> {hashed} {' '.join(entries[hashed]['encodings'])}")
@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import hmac
+import base64
+import hashlib
+import threading
+from collections import deque
+from db import supabase
+
+# ==========================================
+#  VERIFICACIÓN DE TOKENS DE SUPABASE
+# ==========================================
+# Modo local: se valida la firma, exp y aud del access token sin llamar al
+# servidor de auth. Con SUPABASE_JWT_SECRET se usa HS256 (stdlib). Sin secreto,
+# si PyJWT está instalado, se usan las llaves públicas (JWKS) del proyecto con
+# caché y refresco. Si ninguna opción está disponible (o el JWKS no tiene la
+# llave, como en proyectos HS256 sin secreto configurado) se usa get_user remoto.
+
+JWT_SECRET = os.getenv('SUPABASE_JWT_SECRET')
+JWT_AUDIENCE = os.getenv('SUPABASE_JWT_AUD', 'authenticated')
+JWT_LEEWAY = int(os.getenv('SUPABASE_JWT_LEEWAY', 30))
+JWKS_TTL = int(os.getenv('SUPABASE_JWKS_TTL', 600))
+VERIFY_MODE = os.getenv('AUTH_VERIFY_MODE', 'local')  # 'local' | 'remote'
+
+try:
+    import jwt as pyjwt
+except ImportError:
+    pyjwt = None
+
+
+class InvalidToken(Exception):
+    """El token fue rechazado (firma, expiración o audiencia)."""
+
+
+class LocalVerificationUnavailable(Exception):
+    """No hay llave local con la que validar: se debe usar el modo remoto."""
+
+
+# --- LATENCIAS POR CAMINO (local / remoto) ---
+class LatencyStats:
+    def __init__(self, maxlen=2048):
+        self._samples = {}
+        self._counts = {}
+        self._maxlen = maxlen
+        self._lock = threading.Lock()
+
+    def record(self, path, seconds):
+        with self._lock:
+            self._samples.setdefault(path, deque(maxlen=self._maxlen)).append(seconds)
+            self._counts[path] = self._counts.get(path, 0) + 1
+
+    def stats(self):
+        out = {}
+        with self._lock:
+            for path, samples in self._samples.items():
+                s = sorted(samples)
+                pick = lambda q: round(s[min(len(s) - 1, int(q * len(s)))] * 1000, 3)
+                out[path] = {"count": self._counts[path], "p50_ms": pick(0.50),
+                             "p95_ms": pick(0.95), "p99_ms": pick(0.99), "max_ms": round(s[-1] * 1000, 3)}
+        return out
+
+verify_latency = LatencyStats()
+
+
+# --- HS256 CON STDLIB ---
+def _b64decode(segment):
+    return base64.urlsafe_b64decode(segment + '=' * (-len(segment) % 4))
+
+def _check_claims(claims):
+    now = time.time()
+    if 'exp' not in claims or now > claims['exp'] + JWT_LEEWAY:
+        raise InvalidToken("Token expirado")
+    if 'nbf' in claims and now + JWT_LEEWAY < claims['nbf']:
+        raise InvalidToken("Token aún no válido")
+    aud = claims.get('aud')
+    auds = aud if isinstance(aud, list) else [aud]
+    if JWT_AUDIENCE and JWT_AUDIENCE not in auds:
+        raise InvalidToken("Audiencia inválida")
+    if not claims.get('sub'):
+        raise InvalidToken("Token sin usuario")
+    return claims
+
+def _verify_hs256(token):
+    try:
+        header_b64, payload_b64, sig_b64 = token.split('.')
+        header = json.loads(_b64decode(header_b64))
+        signature = _b64decode(sig_b64)
+    except (ValueError, AttributeError) as e:
+        raise InvalidToken(f"Token mal formado: {e}")
+    if header.get('alg') != 'HS256':
+        raise LocalVerificationUnavailable(f"Algoritmo {header.get('alg')} sin llave local")
+    expected = hmac.new(JWT_SECRET.encode(), f"{header_b64}.{payload_b64}".encode(), hashlib.sha256).digest()
+    if not hmac.compare_digest(expected, signature):
+        raise InvalidToken("Firma inválida")
+    return _check_claims(json.loads(_b64decode(payload_b64)))
+
+
+# --- JWKS (LLAVES ASIMÉTRICAS) ---
+_jwks_client = None
+_jwks_lock = threading.Lock()
+
+def _get_jwks_client():
+    global _jwks_client
+    if _jwks_client is None:
+        with _jwks_lock:
+            if _jwks_client is None:
+                url = f"{os.getenv('SUPABASE_URL', '').rstrip('/')}/auth/v1/.well-known/jwks.json"
+                # PyJWKClient cachea el JWKS y lo refresca si aparece un kid desconocido
+                _jwks_client = pyjwt.PyJWKClient(url, cache_keys=True, lifespan=JWKS_TTL)
+    return _jwks_client
+
+def _verify_jwks(token):
+    try:
+        alg = pyjwt.get_unverified_header(token).get('alg')
+    except pyjwt.PyJWTError as e:
+        raise InvalidToken(f"Token mal formado: {e}")
+    # Proyectos con secreto compartido (HS256): el JWKS no trae esa llave
+    if alg == 'HS256': raise LocalVerificationUnavailable("HS256 sin SUPABASE_JWT_SECRET")
+    try:
+        key = _get_jwks_client().get_signing_key_from_jwt(token)
+    except pyjwt.PyJWTError as e:
+        # JWKS vacío, sin llaves utilizables, kid desconocido o inaccesible
+        raise LocalVerificationUnavailable(str(e))
+    try:
+        claims = pyjwt.decode(token, key.key, algorithms=['ES256', 'RS256'],
+                              audience=JWT_AUDIENCE, leeway=JWT_LEEWAY)
+    except pyjwt.PyJWTError as e:
+        raise InvalidToken(str(e))
+    return _check_claims(claims)
+
+
+# --- API PÚBLICA ---
+def verify_local(token):
+    if JWT_SECRET: return _verify_hs256(token)
+    if pyjwt is not None and os.getenv('SUPABASE_URL'): return _verify_jwks(token)
+    raise LocalVerificationUnavailable("Sin SUPABASE_JWT_SECRET ni PyJWT")
+
+def verify_remote(token):
+    user = supabase.auth.get_user(token)
+    if not user or not user.user: raise InvalidToken("Token inválido")
+    return user.user.id
+
+def verify_access_token(token):
+    """Devuelve el id del usuario o lanza InvalidToken."""
+    if not token: raise InvalidToken("Token requerido")
+    if VERIFY_MODE == 'local':
+        start = time.perf_counter()
+        try:
+            uid = verify_local(token)['sub']
+            verify_latency.record('local', time.perf_counter() - start)
+            return uid
+        except LocalVerificationUnavailable:
+            pass
+    start = time.perf_counter()
+    try:
+        return verify_remote(token)
+    finally:
+        verify_latency.record('remote', time.perf_counter() - start)
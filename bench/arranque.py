@@ -0,0 +1,34 @@
+"""Mide el costo de importar la app (mediana de N procesos nuevos).
+
+Uso: python bench/arranque.py [N]
+"""
+import os
+import sys
+import json
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SNIPPET = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+
+def medir(n=10):
+    tiempos = []
+    for _ in range(n):
+        out = subprocess.run([sys.executable, '-c', SNIPPET], cwd=ROOT, env=os.environ,
+                             capture_output=True, text=True, check=True)
+        tiempos.append(float(out.stdout.strip().splitlines()[-1]))
+    return {
+        "n": n,
+        "mediana_ms": round(statistics.median(tiempos) * 1000, 2),
+        "min_ms": round(min(tiempos) * 1000, 2),
+        "max_ms": round(max(tiempos) * 1000, 2),
+    }
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    resultado = medir(n)
+    # El import de supabase/httpx debe ocurrir en la primera consulta, no al arrancar
+    chk = subprocess.run([sys.executable, '-c', "import sys, app; print('supabase' in sys.modules)"],
+                         cwd=ROOT, env=os.environ, capture_output=True, text=True)
+    resultado["supabase_importado"] = chk.stdout.strip() == 'True'
+    print(json.dumps(resultado, indent=2))
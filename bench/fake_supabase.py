@@ -0,0 +1,356 @@
+"""Servidor local que imita PostgREST (/rest/v1) y GoTrue (/auth/v1).
+
+Implementa solo lo que usa la app: filtros eq/neq/gt/gte/lt/lte/in/ilike,
+or=(...) anidado, order, limit/offset, Prefer count=exact y
+return=representation, y las rutas de auth/admin para usuarios. Cada
+respuesta puede llevar una latencia inyectada para simular la red.
+
+Uso: python bench/fake_supabase.py --port 54321 --despachos 100000 --profiles 1000 --latency-ms 20
+"""
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl, unquote
+
+ROLES = ['operario', 'comercial', 'logistico', 'coordinacion', 'administracion']
+MARCAS = ['Thermo', 'Fluke', 'Ludlum', 'Mirion', 'Polimaster', 'Berthold']
+
+# ==========================================
+#  DATOS SEMILLA
+# ==========================================
+def seed(db, n_despachos, n_profiles, rnd=None):
+    rnd = rnd or random.Random(42)
+    profiles = db.setdefault('profiles', [])
+    for i in range(n_profiles):
+        profiles.append({
+            "id": str(uuid.UUID(int=rnd.getrandbits(128))),
+            "full_name": f"Usuario {i:04d}",
+            "email": f"usuario{i:04d}@example.com",
+            "role": ROLES[i % len(ROLES)],
+            "is_active": i % 10 != 0,
+            "last_sign_in_at": None,
+            "updated_at": "2026-01-01T00:00:00+00:00",
+        })
+    despachos = db.setdefault('despachos', [])
+    equipos = db.setdefault('despacho_items', [])
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for i in range(n_despachos):
+        items = [{
+            "marca": rnd.choice(MARCAS), "modelo": f"M-{rnd.randint(100, 999)}",
+            "serie": f"SN{rnd.randint(100000, 999999)}", "unidad": "cpm",
+            "fondo": "10", "instrumento": "50", "neto": str(rnd.randint(0, 80)), "limite": "60",
+        } for _ in range(rnd.randint(1, 5))]
+        despachos.append({
+            "id": i + 1,
+            "created_at": (start + timedelta(minutes=15 * i)).isoformat(),
+            "cliente": f"Cliente {i % 500:03d}",
+            "nit": f"900{i % 500:06d}",
+            "email": f"cliente{i % 500:03d}@example.com",
+            "responsable_medicion": f"Responsable {i % 97}",
+            "cargo": "Oficial de protección radiológica",
+            "ref_marca": items[0]['marca'], "ref_modelo": items[0]['modelo'], "ref_serie": items[0]['serie'],
+            "num_items": len(items),
+            "items_resumen": ' · '.join(f"{it['marca']} {it['modelo']}" for it in items[:3]),
+            "fecha_solicitada": None,
+            "instrumento_contaminacion": None,
+            "estado": "pendiente" if i % 4 == 0 else "recibido",
+        })
+        for n, it in enumerate(items, 1):
+            equipos.append(dict(it, id=len(equipos) + 1, despacho_id=i + 1, posicion=n))
+    return db
+
+# ==========================================
+#  FILTROS ESTILO POSTGREST
+# ==========================================
+def _coerce(value, sample):
+    if isinstance(sample, bool): return value == 'true'
+    if isinstance(sample, int):
+        try: return int(value)
+        except ValueError: return value
+    if value == 'null': return None
+    return value
+
+def _match(row, col, op, raw):
+    val = row.get(col)
+    if op == 'is': return (val is None) if raw == 'null' else (str(val).lower() == raw)
+    if op == 'in':
+        opts = [v.strip().strip('"') for v in raw.strip('()').split(',')]
+        return str(val) in opts
+    target = _coerce(raw.strip('"'), val)
+    if op in ('like', 'ilike'):
+        pattern = '^' + re.escape(target).replace('\\*', '.*').replace('%', '.*') + '$'
+        return re.match(pattern, str(val or ''), re.I if op == 'ilike' else 0) is not None
+    if val is None: return False
+    try:
+        if op == 'eq': return val == target
+        if op == 'neq': return val != target
+        if op == 'gt': return val > target
+        if op == 'gte': return val >= target
+        if op == 'lt': return val < target
+        if op == 'lte': return val <= target
+    except TypeError:
+        return False
+    raise ValueError(f"Operador no soportado: {op}")
+
+def _split_top(s):
+    """Separa por comas que no estén dentro de paréntesis ni comillas."""
+    parts, depth, quoted, cur = [], 0, False, ''
+    for ch in s:
+        if ch == '"': quoted = not quoted
+        if not quoted and ch == '(': depth += 1
+        if not quoted and ch == ')': depth -= 1
+        if ch == ',' and depth == 0 and not quoted:
+            parts.append(cur); cur = ''
+        else:
+            cur += ch
+    if cur: parts.append(cur)
+    return parts
+
+def _compile_logic(kind, body):
+    preds = []
+    for part in _split_top(body):
+        m = re.match(r'^(and|or)\((.*)\)$', part)
+        if m:
+            preds.append(_compile_logic(m.group(1), m.group(2)))
+        else:
+            col, op, raw = part.split('.', 2)
+            preds.append(lambda r, c=col, o=op, v=raw: _match(r, c, o, v))
+    if kind == 'and': return lambda r: all(p(r) for p in preds)
+    return lambda r: any(p(r) for p in preds)
+
+def build_query(params):
+    preds, order, limit, offset, select = [], [], None, 0, '*'
+    for key, value in params:
+        if key == 'select': select = value
+        elif key == 'order':
+            for part in value.split(','):
+                bits = part.split('.')
+                order.append((bits[0], len(bits) > 1 and bits[1] == 'desc'))
+        elif key == 'limit': limit = int(value)
+        elif key == 'offset': offset = int(value)
+        elif key in ('columns', 'on_conflict'): continue  # usados por insert/upsert masivos
+        elif key in ('or', 'and'):
+            preds.append(_compile_logic(key, value[1:-1]))
+        else:
+            op, raw = value.split('.', 1)
+            if op == 'not':
+                op2, raw2 = raw.split('.', 1)
+                preds.append(lambda r, c=key, o=op2, v=raw2: not _match(r, c, o, v))
+            else:
+                preds.append(lambda r, c=key, o=op, v=raw: _match(r, c, o, v))
+    return preds, order, limit, offset, select
+
+def _project(row, select):
+    if select.strip() == '*': return dict(row)
+    cols = [c.strip() for c in select.split(',') if c.strip()]
+    return {c: row.get(c) for c in cols}
+
+# ==========================================
+#  SERVIDOR
+# ==========================================
+class FakeSupabase:
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0):
+        self.db = {}
+        self.users = {}
+        self.lock = threading.RLock()
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.requests = 0
+
+    def sleep(self):
+        delay = self.latency + (random.random() * self.jitter if self.jitter else 0)
+        if delay > 0: time.sleep(delay)
+
+    def user_json(self, uid):
+        p = next((p for p in self.db.get('profiles', []) if p['id'] == uid), {})
+        return {
+            "id": uid, "aud": "authenticated", "role": "authenticated",
+            "email": p.get('email', f"{uid}@example.com"),
+            "app_metadata": {"provider": "email"},
+            "user_metadata": {"full_name": p.get('full_name'), "role": p.get('role')},
+            "created_at": "2026-01-01T00:00:00Z", "updated_at": "2026-01-01T00:00:00Z",
+        }
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args): pass
+
+        def _send(self, status, payload=None, headers=None):
+            body = b'' if payload is None else json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for k, v in (headers or {}).items(): self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _body(self):
+            n = int(self.headers.get('Content-Length') or 0)
+            return json.loads(self.rfile.read(n) or b'null') if n else None
+
+        def _dispatch(self, method):
+            fake.sleep()
+            with fake.lock: fake.requests += 1
+            # Leer siempre el cuerpo: con keep-alive no puede quedar en el socket
+            self.payload = self._body()
+            parts = urlsplit(self.path)
+            path = unquote(parts.path)
+            params = parse_qsl(parts.query, keep_blank_values=True)
+            try:
+                if path.startswith('/rest/v1/'):
+                    return self._rest(method, path[len('/rest/v1/'):], params)
+                if path.startswith('/auth/v1/'):
+                    return self._auth(method, path[len('/auth/v1/'):])
+                self._send(404, {"message": "not found"})
+            except Exception as e:
+                self._send(400, {"message": str(e), "code": "PGRST100"})
+
+        # --- POSTGREST ---
+        def _rest(self, method, table, params):
+            prefer = self.headers.get('Prefer', '')
+            if table.startswith('rpc/'): return self._rpc(table[len('rpc/'):])
+            preds, order, limit, offset, select = build_query(params)
+            with fake.lock:
+                rows = fake.db.setdefault(table, [])
+                if method == 'POST':
+                    payload = self.payload
+                    payload = payload if isinstance(payload, list) else [payload]
+                    out = []
+                    for r in payload:
+                        r = dict(r)
+                        if table == 'profiles':
+                            r.setdefault('id', str(uuid.uuid4()))
+                        else:
+                            r.setdefault('id', max((x['id'] for x in rows[-1:]), default=0) + 1)
+                        r.setdefault('created_at', datetime.now(timezone.utc).isoformat())
+                        rows.append(r)
+                        out.append(r)
+                    return self._send(201, [_project(r, select) for r in out]
+                                      if 'return=representation' in prefer else None)
+
+                matched = [r for r in rows if all(p(r) for p in preds)]
+                if method == 'PATCH':
+                    changes = self.payload or {}
+                    for r in matched: r.update(changes)
+                    return self._send(200, [_project(r, select) for r in matched]
+                                      if 'return=representation' in prefer else None)
+                if method == 'DELETE':
+                    for r in matched: rows.remove(r)
+                    return self._send(200, [_project(r, select) for r in matched]
+                                      if 'return=representation' in prefer else None)
+
+                total = len(matched)
+                for col, desc in reversed(order):
+                    matched.sort(key=lambda r: (r.get(col) is None, r.get(col)), reverse=desc)
+                page = matched[offset:offset + limit if limit is not None else None]
+                data = [_project(r, select) for r in page]
+            headers = {}
+            if 'count=' in prefer:
+                end = offset + len(data) - 1
+                headers['Content-Range'] = f"{offset}-{end}/{total}" if data else f"*/{total}"
+            if self.command == 'HEAD': data = None
+            self._send(200, data, headers)
+
+        # --- FUNCIONES (RPC) ---
+        def _rpc(self, name):
+            if name != 'ambiental_merge_rollups': return self._send(404, {"message": f"function {name} not found"})
+            args = self.payload or {}
+            with fake.lock:
+                lotes = fake.db.setdefault('ambiental_lotes', [])
+                if any(l['id'] == args['lote'] for l in lotes): return self._send(200, None)
+                lotes.append({"id": args['lote']})
+                rows = fake.db.setdefault('ambiental_rollups', [])
+                index = {(r['sensor_id'], r['nivel'], r['inicio']): r for r in rows}
+                for f in args['filas']:
+                    r = index.get((f['sensor_id'], f['nivel'], f['inicio']))
+                    if r is None:
+                        r = index[(f['sensor_id'], f['nivel'], f['inicio'])] = dict(f)
+                        rows.append(r)
+                    else:
+                        for name in ('temp', 'hum'):
+                            r[f'{name}_n'] += f[f'{name}_n']
+                            r[f'{name}_sum'] += f[f'{name}_sum']
+                            for col, pick in (('min', min), ('max', max)):
+                                vals = [v for v in (r[f'{name}_{col}'], f[f'{name}_{col}']) if v is not None]
+                                r[f'{name}_{col}'] = pick(vals) if vals else None
+                    # Columnas generadas
+                    for name in ('temp', 'hum'):
+                        r[f'{name}_mean'] = r[f'{name}_sum'] / r[f'{name}_n'] if r[f'{name}_n'] else None
+            self._send(200, None)
+
+        # --- AUTH (GOTRUE) ---
+        def _auth(self, method, path):
+            if path == 'user' and method == 'GET':
+                token = (self.headers.get('Authorization') or '').removeprefix('Bearer ').strip()
+                uid = fake.users.get(token) or _sub_from_jwt(token)
+                if not uid: return self._send(401, {"msg": "invalid token"})
+                return self._send(200, fake.user_json(uid))
+            if path == 'admin/users' and method == 'POST':
+                body = self.payload or {}
+                uid = str(uuid.uuid4())
+                meta = body.get('user_metadata') or {}
+                with fake.lock:
+                    fake.db.setdefault('profiles', []).append({
+                        "id": uid, "full_name": meta.get('full_name'), "email": body.get('email'),
+                        "role": meta.get('role'), "is_active": True, "last_sign_in_at": None,
+                        "updated_at": datetime.now(timezone.utc).isoformat(),
+                    })
+                return self._send(200, fake.user_json(uid))
+            m = re.match(r'^admin/users/([^/]+)$', path)
+            if m and method == 'PUT':
+                return self._send(200, fake.user_json(m.group(1)))
+            if m and method == 'DELETE':
+                with fake.lock:
+                    fake.db['profiles'] = [p for p in fake.db.get('profiles', []) if p['id'] != m.group(1)]
+                return self._send(200, {})
+            self._send(404, {"msg": "not found"})
+
+        def do_GET(self): self._dispatch('GET')
+        def do_HEAD(self): self._dispatch('GET')
+        def do_POST(self): self._dispatch('POST')
+        def do_PATCH(self): self._dispatch('PATCH')
+        def do_PUT(self): self._dispatch('PUT')
+        def do_DELETE(self): self._dispatch('DELETE')
+
+    return Handler
+
+def _sub_from_jwt(token):
+    import base64
+    try:
+        payload = token.split('.')[1]
+        return json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4))).get('sub')
+    except Exception:
+        return None
+
+def serve(port=0, latency_ms=0.0, jitter_ms=0.0, despachos=0, profiles=0):
+    """Arranca el servidor en un hilo. Devuelve (server, fake)."""
+    fake = FakeSupabase(latency_ms, jitter_ms)
+    seed(fake.db, despachos, profiles)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(fake))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, fake
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--port', type=int, default=54321)
+    ap.add_argument('--latency-ms', type=float, default=0)
+    ap.add_argument('--jitter-ms', type=float, default=0)
+    ap.add_argument('--despachos', type=int, default=100000)
+    ap.add_argument('--profiles', type=int, default=1000)
+    args = ap.parse_args()
+    server, _ = serve(args.port, args.latency_ms, args.jitter_ms, args.despachos, args.profiles)
+    print(f"Supabase falso en http://127.0.0.1:{server.server_address[1]}", file=sys.stderr)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,96 @@
+"""Compara el índice de búsqueda de despachos contra un recorrido completo.
+
+Genera despachos con los datos semilla de bench/fake_supabase.py, construye
+el índice en memoria (sin Supabase) y mide la latencia de consultas típicas
+de typeahead (prefijos de cliente, NIT y serie) contra el filtro ingenuo que
+revisa cada despacho y cada equipo con 'in'.
+
+Uso: python bench/indice_busqueda.py [--despachos 100000] [--queries 300]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+import fake_supabase
+from busqueda import DespachoIndex, normalize, tokenize
+
+def naive_search(rows, query, limit=None):
+    """Lo que haría el navegador o un ilike por cada campo: todo en lineal."""
+    tokens = tokenize(query)
+    out = []
+    for r in rows:
+        campos = [r.get('cliente'), r.get('nit'), r.get('email'), r.get('ref_serie')]
+        for item in r.get('items') or []:
+            campos += [item.get('marca'), item.get('modelo'), item.get('serie')]
+        texto = normalize(' '.join(str(c) for c in campos if c))
+        if all(t in texto for t in tokens): out.append(r)
+    out.sort(key=lambda r: r['created_at'], reverse=True)
+    return out[:limit] if limit else out
+
+def sample_queries(rows, n, rnd):
+    queries = []
+    for _ in range(n):
+        r = rnd.choice(rows)
+        kind = rnd.choice(('cliente', 'nit', 'serie', 'marca'))
+        if kind == 'cliente': queries.append(r['cliente'][:rnd.randint(4, len(r['cliente']))])
+        elif kind == 'nit': queries.append(r['nit'][:rnd.randint(5, len(r['nit']))])
+        elif kind == 'serie': queries.append(rnd.choice(r['items'])['serie'][:rnd.randint(4, 8)])
+        else: queries.append(f"{r['items'][0]['marca'][:4]} {r['cliente']}")
+    return queries
+
+def timed(fn, queries):
+    tiempos = []
+    for q in queries:
+        start = time.perf_counter()
+        fn(q)
+        tiempos.append(time.perf_counter() - start)
+    tiempos.sort()
+    pick = lambda p: round(tiempos[min(len(tiempos) - 1, int(p * len(tiempos)))] * 1000, 3)
+    return {"p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "max_ms": round(tiempos[-1] * 1000, 3)}
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--despachos', type=int, default=100000)
+    ap.add_argument('--queries', type=int, default=300)
+    ap.add_argument('--seed', type=int, default=1)
+    args = ap.parse_args()
+
+    db = fake_supabase.seed({}, args.despachos, 0)
+    rows = db['despachos']
+    # El índice recibe los equipos de la tabla hija igual que en _scan()
+    por_despacho = {}
+    for it in db['despacho_items']: por_despacho.setdefault(it['despacho_id'], []).append(it)
+    for r in rows: r['items'] = por_despacho.get(r['id'], [])
+    index = DespachoIndex()
+    start = time.perf_counter()
+    index.load(rows)
+    build = time.perf_counter() - start
+
+    queries = sample_queries(rows, args.queries, random.Random(args.seed))
+    # Todo lo que devuelve el índice debe aparecer también en el recorrido
+    # (prefijo de término implica subcadena; el orden sí cambia por relevancia)
+    invalidos = sum(1 for q in queries[:50]
+                    if not {d['id'] for d in index.search(q, 10)} <= {r['id'] for r in naive_search(rows, q)})
+    # Un token que no existe en el índice no debe fallar, solo no encontrar nada
+    sin_coincidencia = ['zzzz', f"{rows[0]['cliente']} zzzz", 'qqq 900']
+    fallidas = [q for q in sin_coincidencia if index.search(q, 10) or naive_search(rows, q)]
+    resultado = {
+        "despachos": len(rows),
+        "terminos": index.stats()['terminos'],
+        "construccion_s": round(build, 3),
+        "indice": timed(lambda q: index.search(q, 10), queries),
+        "recorrido": timed(lambda q: naive_search(rows, q, 10), queries),
+        "consultas_con_resultados_invalidos": invalidos,
+        "sin_coincidencia_con_resultados": fallidas,
+    }
+    print(json.dumps(resultado, indent=2, ensure_ascii=False))
+
+if __name__ == '__main__':
+    main()
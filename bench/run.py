@@ -0,0 +1,265 @@
+"""Benchmark de carga de la app contra Supabase y SMTP locales.
+
+Arranca bench/fake_supabase.py (PostgREST + auth con datos semilla),
+bench/smtp_sink.py y la app Flask en hilos del mismo proceso. Luego lanza
+usuarios virtuales con una mezcla realista de rutas, y al final una ráfaga
+de envíos al formulario público. Reporta throughput y p50/p95/p99 por
+endpoint. Con --save el resultado queda como baseline y con --compare se
+contrasta contra uno anterior.
+
+Uso:
+    python bench/run.py --duration 30 --users 16 --latency-ms 20 --save bench/resultados/baseline.json
+    python bench/run.py --compare bench/resultados/baseline.json
+"""
+import os
+import sys
+import json
+import time
+import hmac
+import base64
+import random
+import hashlib
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from datetime import datetime, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+sys.path.insert(0, ROOT)
+
+import fake_supabase
+import smtp_sink
+
+JWT_SECRET = 'bench-jwt-secret'
+
+# Mezcla por defecto: (nombre, peso)
+DEFAULT_MIX = {
+    'home': 25,
+    'despacho': 20,
+    'api_users': 10,
+    'api_session': 35,
+    'public_save': 10,
+}
+
+# ==========================================
+#  UTILIDADES
+# ==========================================
+def make_token(uid, ttl=3600):
+    enc = lambda d: base64.urlsafe_b64encode(json.dumps(d).encode()).rstrip(b'=').decode()
+    header = enc({"alg": "HS256", "typ": "JWT"})
+    payload = enc({"sub": uid, "aud": "authenticated", "role": "authenticated", "exp": int(time.time()) + ttl})
+    sig = hmac.new(JWT_SECRET.encode(), f"{header}.{payload}".encode(), hashlib.sha256).digest()
+    return f"{header}.{payload}.{base64.urlsafe_b64encode(sig).rstrip(b'=').decode()}"
+
+def percentile(sorted_values, q):
+    if not sorted_values: return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+def sample_submission(rnd):
+    n = rnd.randint(1, 8)
+    return {
+        "cliente": f"Cliente Bench {rnd.randint(1, 50)}", "nit": str(rnd.randint(800000000, 999999999)),
+        "email": "cliente@example.com", "responsable_medicion": "Responsable Bench", "cargo": "OPR",
+        "ref_marca": "Ludlum", "ref_modelo": "3", "ref_serie": str(rnd.randint(1000, 9999)),
+        "fecha_solicitada": datetime.now(timezone.utc).isoformat(),
+        "items": [{"marca": "Ludlum", "modelo": "44-9", "serie": f"SN{rnd.randint(1, 10**6)}",
+                   "unidad": "cpm", "fondo": "10", "instrumento": "50", "neto": "40", "limite": "60"}
+                  for _ in range(n)],
+    }
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+
+    def record(self, name, seconds, ok):
+        with self.lock:
+            self.samples.setdefault(name, []).append(seconds)
+            if not ok: self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summary(self, duration):
+        out = {}
+        for name, values in sorted(self.samples.items()):
+            s = sorted(values)
+            out[name] = {
+                "count": len(s),
+                "errors": self.errors.get(name, 0),
+                "rps": round(len(s) / duration, 2) if duration else 0.0,
+                "p50_ms": round(percentile(s, 0.50) * 1000, 2),
+                "p95_ms": round(percentile(s, 0.95) * 1000, 2),
+                "p99_ms": round(percentile(s, 0.99) * 1000, 2),
+                "max_ms": round(s[-1] * 1000, 2),
+            }
+        return out
+
+class Client:
+    """Cliente HTTP keep-alive con manejo mínimo de la cookie de sesión."""
+
+    def __init__(self, port, recorder):
+        self.port = port
+        self.recorder = recorder
+        self.cookie = None
+        self.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+
+    def request(self, name, method, path, body=None):
+        headers = {}
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        if self.cookie: headers['Cookie'] = self.cookie
+        start = time.perf_counter()
+        ok = False
+        try:
+            self.conn.request(method, path, body=body, headers=headers)
+            resp = self.conn.getresponse()
+            resp.read()
+            set_cookie = resp.getheader('Set-Cookie')
+            if set_cookie: self.cookie = set_cookie.split(';', 1)[0]
+            ok = resp.status < 400
+        except (http.client.HTTPException, OSError):
+            self.conn.close()
+            self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        self.recorder.record(name, time.perf_counter() - start, ok)
+        return ok
+
+# ==========================================
+#  ESCENARIOS
+# ==========================================
+SCENARIOS = {
+    'home': lambda c, rnd: c.request('home', 'GET', '/home'),
+    'despacho': lambda c, rnd: c.request('despacho', 'GET', '/despacho'),
+    'api_users': lambda c, rnd: c.request('api_users', 'GET', '/api/users'),
+    'api_session': lambda c, rnd: c.request('api_session', 'GET', '/api/session'),
+    'public_save': lambda c, rnd: c.request('public_save', 'POST', '/api/public/guardar-despacho', sample_submission(rnd)),
+}
+
+def virtual_user(port, recorder, uid, mix, deadline, seed):
+    rnd = random.Random(seed)
+    client = Client(port, recorder)
+    client.request('login', 'POST', '/api/set-session', {"access_token": make_token(uid)})
+    names, weights = zip(*mix.items())
+    while time.monotonic() < deadline:
+        SCENARIOS[rnd.choices(names, weights)[0]](client, rnd)
+
+def burst(port, recorder, size, seed):
+    barrier = threading.Barrier(size)
+    def one(i):
+        rnd = random.Random(seed + i)
+        client = Client(port, recorder)
+        barrier.wait()
+        client.request('burst_public_save', 'POST', '/api/public/guardar-despacho', sample_submission(rnd))
+    threads = [threading.Thread(target=one, args=(i,)) for i in range(size)]
+    start = time.perf_counter()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    return time.perf_counter() - start
+
+# ==========================================
+#  ARRANQUE
+# ==========================================
+def boot(args):
+    sb_server, fake = fake_supabase.serve(0, args.latency_ms, args.jitter_ms, args.despachos, args.profiles)
+    smtp_server, smtp_stats = smtp_sink.serve(0, args.smtp_latency_ms)
+    spool = tempfile.mkdtemp(prefix='sgil-bench-spool-')
+    os.environ.update({
+        'SUPABASE_URL': f"http://127.0.0.1:{sb_server.server_address[1]}",
+        'SUPABASE_KEY': 'bench-anon-key', 'SUPABASE_SERVICE_KEY': 'bench-service-key',
+        'SUPABASE_JWT_SECRET': JWT_SECRET,
+        'AUTH_VERIFY_MODE': 'remote' if args.remote_auth else 'local',
+        'SECRET_KEY': 'bench',
+        'MAIL_SERVER': '127.0.0.1', 'MAIL_PORT': str(smtp_server.server_address[1]),
+        'MAIL_USE_TLS': '0', 'MAIL_USERNAME': 'sistema@example.com', 'MAIL_PASSWORD': '',
+        'MAIL_LOGISTICS': 'logistica@example.com', 'MAIL_SPOOL_DIR': spool,
+        'SLOW_REQUEST_MS': '100000',
+        # Todo el tráfico sale de 127.0.0.1: sin límite por IP/NIT en el benchmark
+        'RATE_LIMIT_IP_PER_MIN': '0', 'RATE_LIMIT_NIT_PER_MIN': '0',
+    })
+    from werkzeug.serving import make_server
+    from app import app
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, fake, smtp_stats
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(current, baseline):
+    print(f"\nComparación contra {baseline['meta'].get('commit')} ({baseline['meta'].get('timestamp')}):")
+    print(f"{'endpoint':<20}{'rps':>18}{'p50 ms':>20}{'p99 ms':>20}")
+    for name, cur in current['endpoints'].items():
+        base = baseline['endpoints'].get(name)
+        if not base: continue
+        fmt = lambda k: f"{base[k]:>8} -> {cur[k]:<8}"
+        print(f"{name:<20}{fmt('rps'):>18}{fmt('p50_ms'):>20}{fmt('p99_ms'):>20}")
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--duration', type=float, default=20, help='segundos de carga mixta')
+    ap.add_argument('--users', type=int, default=8, help='usuarios virtuales concurrentes')
+    ap.add_argument('--burst', type=int, default=50, help='envíos simultáneos al formulario público (0 = omitir)')
+    ap.add_argument('--despachos', type=int, default=100000)
+    ap.add_argument('--profiles', type=int, default=1000)
+    ap.add_argument('--latency-ms', type=float, default=10, help='latencia inyectada por llamada a Supabase')
+    ap.add_argument('--jitter-ms', type=float, default=0)
+    ap.add_argument('--smtp-latency-ms', type=float, default=50)
+    ap.add_argument('--remote-auth', action='store_true', help='forzar verificación de token remota')
+    ap.add_argument('--mix', type=json.loads, default=DEFAULT_MIX, help='JSON {escenario: peso}')
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--save', help='ruta donde guardar el resultado (JSON)')
+    ap.add_argument('--compare', help='baseline (JSON) contra el cual comparar')
+    args = ap.parse_args()
+
+    print("Arrancando Supabase falso, SMTP sink y la app...", file=sys.stderr)
+    server, fake, smtp_stats = boot(args)
+    port = server.server_address[1]
+
+    staff = [p['id'] for p in fake.db['profiles'] if p['role'] in ('administracion', 'coordinacion')]
+    recorder = Recorder()
+    deadline = time.monotonic() + args.duration
+    threads = [threading.Thread(target=virtual_user,
+                                args=(port, recorder, staff[i % len(staff)], args.mix, deadline, args.seed + i))
+               for i in range(args.users)]
+    print(f"Carga mixta: {args.users} usuarios durante {args.duration}s", file=sys.stderr)
+    start = time.perf_counter()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = time.perf_counter() - start
+    endpoints = recorder.summary(elapsed)
+
+    if args.burst:
+        print(f"Ráfaga: {args.burst} envíos simultáneos", file=sys.stderr)
+        burst_recorder = Recorder()
+        burst_elapsed = burst(port, burst_recorder, args.burst, args.seed * 1000)
+        endpoints.update(burst_recorder.summary(burst_elapsed))
+
+    result = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            "config": {k: v for k, v in vars(args).items() if k not in ('save', 'compare')},
+            "upstream_requests": fake.requests,
+            "smtp_messages": smtp_stats.messages,
+        },
+        "endpoints": endpoints,
+    }
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w', encoding='utf-8') as fh:
+            json.dump(result, fh, indent=2, ensure_ascii=False)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as fh:
+            compare(result, json.load(fh))
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
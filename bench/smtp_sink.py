@@ -0,0 +1,77 @@
+"""Sumidero SMTP mínimo (sin dependencias): acepta y descarta mensajes.
+
+Entiende EHLO/HELO, MAIL, RCPT, DATA, RSET, NOOP y QUIT, sin STARTTLS ni AUTH
+(usar MAIL_USE_TLS=0 y MAIL_PASSWORD vacío). Sirve como stand-in de
+smtpd/aiosmtpd para el benchmark y pruebas manuales del outbox.
+
+Uso: python bench/smtp_sink.py --port 8025
+"""
+import sys
+import time
+import argparse
+import threading
+import socketserver
+
+class SinkStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.messages = 0
+        self.sessions = 0
+        self.bytes = 0
+
+def make_handler(stats, latency):
+    class Handler(socketserver.StreamRequestHandler):
+        def reply(self, line):
+            self.wfile.write(line.encode() + b'\r\n')
+
+        def handle(self):
+            with stats.lock: stats.sessions += 1
+            self.reply('220 sink ESMTP')
+            while True:
+                line = self.rfile.readline()
+                if not line: return
+                cmd = line.decode('utf-8', 'replace').strip().upper()
+                if cmd.startswith(('EHLO', 'HELO')):
+                    self.wfile.write(b'250-sink\r\n250 8BITMIME\r\n')
+                elif cmd.startswith(('MAIL', 'RCPT', 'RSET', 'NOOP')):
+                    self.reply('250 OK')
+                elif cmd == 'DATA':
+                    self.reply('354 End data with <CR><LF>.<CR><LF>')
+                    size = 0
+                    for data_line in self.rfile:
+                        if data_line in (b'.\r\n', b'.\n'): break
+                        size += len(data_line)
+                    if latency: time.sleep(latency)
+                    with stats.lock:
+                        stats.messages += 1
+                        stats.bytes += size
+                    self.reply('250 OK queued')
+                elif cmd == 'QUIT':
+                    self.reply('221 Bye')
+                    return
+                else:
+                    self.reply('502 Command not implemented')
+    return Handler
+
+def serve(port=0, latency_ms=0.0):
+    """Arranca el sumidero en un hilo. Devuelve (server, stats)."""
+    stats = SinkStats()
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', port), make_handler(stats, latency_ms / 1000))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stats
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--port', type=int, default=8025)
+    ap.add_argument('--latency-ms', type=float, default=0)
+    args = ap.parse_args()
+    server, stats = serve(args.port, args.latency_ms)
+    print(f"SMTP sink en 127.0.0.1:{server.server_address[1]}", file=sys.stderr)
+    try:
+        while True:
+            time.sleep(5)
+            print(f"sesiones={stats.sessions} mensajes={stats.messages}", file=sys.stderr)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,292 @@
+import os
+import re
+import time
+from datetime import datetime, timedelta
+import bisect
+import heapq
+import threading
+import unicodedata
+from collections import Counter
+from db import supabase_admin
+from equipos import fetch_items
+
+# ==========================================
+#  ÍNDICE DE BÚSQUEDA DE DESPACHOS (EN MEMORIA)
+# ==========================================
+# Índice invertido término -> {id_despacho: peso} sobre cliente, NIT, email,
+# serie de referencia y marca/modelo/serie de cada equipo. Los términos se
+# guardan además en una lista ordenada para resolver prefijos con bisect
+# (typeahead). Se construye completo en segundo plano en la primera petición
+# de cada proceso y se actualiza desde api_public_save. Las altas de otros
+# workers se recogen cada SEARCH_CATCHUP_INTERVAL segundos leyendo solo lo
+# creado desde el último despacho visto (con un margen por commits tardíos);
+# no se vuelve a recorrer la tabla. El estado que muestra un resultado es el
+# de cuando se indexó. Mientras no está listo, search() responde con un
+# ilike directo.
+
+INDEX_COLUMNS = "id, created_at, cliente, nit, email, ref_serie, estado, num_items"
+INDEX_ITEM_COLUMNS = "marca, modelo, serie"
+INDEX_PAGE = 1000
+CATCHUP_OVERLAP = 120  # segundos hacia atrás: altas que hicieron commit tarde
+MAX_EXPANSIONS = 200  # términos máximos por prefijo (evita que "s" recorra todo)
+
+# Peso por campo: una serie o NIT exactos valen más que una marca común
+FIELD_WEIGHTS = {'nit': 5, 'ref_serie': 4, 'serie': 4, 'cliente': 3, 'email': 2, 'modelo': 1, 'marca': 1}
+
+_SPLIT = re.compile(r'[^0-9a-z]+')
+
+def normalize(text):
+    """Minúsculas y sin tildes: 'Medellín' y 'medellin' son el mismo término."""
+    text = unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode()
+    return text.lower()
+
+def tokenize(text):
+    return [t for t in _SPLIT.split(normalize(text)) if t]
+
+def _doc_terms(row):
+    """Términos del despacho con el mayor peso con que aparecen."""
+    terms = {}
+    def add(value, weight):
+        if not value: return
+        tokens = tokenize(value)
+        # El valor completo sin separadores también es término ("900-123" -> "900123")
+        if len(tokens) > 1: tokens.append(''.join(tokens))
+        for t in tokens:
+            if weight > terms.get(t, 0): terms[t] = weight
+    for field in ('cliente', 'nit', 'email', 'ref_serie'):
+        add(row.get(field), FIELD_WEIGHTS[field])
+    for item in row.get('items') or []:
+        for field in ('marca', 'modelo', 'serie'):
+            add(item.get(field), FIELD_WEIGHTS[field])
+    return terms
+
+def _summary(row):
+    return {k: row.get(k) for k in ('id', 'created_at', 'cliente', 'nit', 'estado')}
+
+
+class DespachoIndex:
+    def __init__(self, catchup_interval=0):
+        self.catchup_interval = catchup_interval
+        self._lock = threading.Lock()
+        self._postings = {}
+        self._terms = []
+        self._docs = {}
+        self._created = {}  # id -> created_at, para desempatar sin lambdas
+        self._loaded_at = None  # última carga completa o puesta al día
+        self._last_created = ''  # created_at más reciente leído de la tabla
+        self._building = False
+        self._pending = None  # altas recibidas durante una reconstrucción
+        self._ready = threading.Event()
+        self.build_seconds = 0.0
+
+    # --- ACTUALIZACIÓN INCREMENTAL ---
+    @staticmethod
+    def _add(postings, docs, created, row):
+        doc_id = row['id']
+        docs[doc_id] = _summary(row)
+        created[doc_id] = row.get('created_at') or ''
+        new_terms = []
+        for term, weight in _doc_terms(row).items():
+            plist = postings.get(term)
+            if plist is None:
+                plist = postings[term] = {}
+                new_terms.append(term)
+            plist[doc_id] = weight
+        return new_terms
+
+    def add(self, row):
+        """Indexa un despacho recién insertado (fila devuelta por el insert)."""
+        if not row or row.get('id') is None: return
+        with self._lock:
+            if self._loaded_at is None: return
+            for term in self._add(self._postings, self._docs, self._created, row):
+                bisect.insort(self._terms, term)
+            if self._pending is not None: self._pending.append(row)
+
+    # --- CONSTRUCCIÓN COMPLETA ---
+    def _scan(self):
+        cursor = None
+        while True:
+            q = supabase_admin.table('despachos').select(INDEX_COLUMNS)
+            if cursor is not None: q = q.gt('id', cursor)
+            rows = q.order('id').limit(INDEX_PAGE).execute().data
+            # Equipos de la página en una sola consulta a la tabla hija
+            items = fetch_items([r['id'] for r in rows if r.get('num_items')], INDEX_ITEM_COLUMNS)
+            for r in rows: r['items'] = items.get(r['id'])
+            yield from rows
+            if len(rows) < INDEX_PAGE: return
+            cursor = rows[-1]['id']
+
+    def load(self, rows):
+        """Reemplaza el índice con las filas dadas (recorrido completo o pruebas)."""
+        postings, docs, created = {}, {}, {}
+        for r in rows: self._add(postings, docs, created, r)
+        last = max(created.values(), default='')
+        with self._lock:
+            # Altas que llegaron mientras se recorría la tabla
+            for r in self._pending or ():
+                if r['id'] not in docs: self._add(postings, docs, created, r)
+            self._postings, self._docs, self._created = postings, docs, created
+            self._terms = sorted(postings)
+            self._last_created = last
+            self._loaded_at = time.monotonic()
+        self._ready.set()
+
+    def build(self):
+        with self._lock:
+            if self._building: return
+            self._building = True
+            self._pending = []
+        start = time.perf_counter()
+        try:
+            self.load(self._scan())
+        finally:
+            with self._lock:
+                self._building = False
+                self._pending = None
+            self.build_seconds = time.perf_counter() - start
+
+    # --- PUESTA AL DÍA INCREMENTAL ---
+    def catch_up(self):
+        """Indexa lo creado desde el último despacho visto. Devuelve cuántos."""
+        with self._lock:
+            if self._building or self._loaded_at is None: return 0
+            self._building = True
+            since = self._last_created
+        try:
+            cutoff = (datetime.fromisoformat(since) - timedelta(seconds=CATCHUP_OVERLAP)).isoformat() if since else None
+            added, offset = 0, 0
+            while True:
+                q = supabase_admin.table('despachos').select(INDEX_COLUMNS)
+                if cutoff: q = q.gte('created_at', cutoff)
+                rows = q.order('created_at').order('id').range(offset, offset + INDEX_PAGE - 1).execute().data
+                # El margen repite filas ya indexadas (propias o de la vuelta anterior)
+                new = [r for r in rows if r['id'] not in self._docs]
+                items = fetch_items([r['id'] for r in new if r.get('num_items')], INDEX_ITEM_COLUMNS)
+                with self._lock:
+                    new_terms = []
+                    for r in new:
+                        r['items'] = items.get(r['id'])
+                        new_terms += self._add(self._postings, self._docs, self._created, r)
+                    if new_terms: self._terms = list(heapq.merge(self._terms, sorted(set(new_terms))))
+                    if rows: self._last_created = max(self._last_created, rows[-1].get('created_at') or '')
+                added += len(new)
+                if len(rows) < INDEX_PAGE: break
+                offset += INDEX_PAGE
+            return added
+        finally:
+            with self._lock:
+                self._building = False
+                self._loaded_at = time.monotonic()
+
+    def _safe_build(self):
+        try:
+            if self._loaded_at is None: self.build()
+            else: self.catch_up()
+        except Exception as e: print(f"Error actualizando índice de búsqueda: {e}")
+
+    def start(self):
+        """Construye el índice (o lo pone al día) en segundo plano."""
+        threading.Thread(target=self._safe_build, name="indice-despachos", daemon=True).start()
+
+    def _maybe_build(self):
+        """True si el índice está listo; si no, lo manda a construir y no espera."""
+        if self._loaded_at is None:
+            if not self._building: self.start()
+            return False
+        if self.catchup_interval and not self._building \
+                and time.monotonic() - self._loaded_at > self.catchup_interval:
+            self.start()
+        return True
+
+    @staticmethod
+    def _fallback(tokens, limit):
+        """Búsqueda directa (ilike) mientras el índice se construye.
+
+        Los tokens solo tienen [0-9a-z], así que van seguros en el filtro.
+        """
+        clauses = [f"or({','.join(f'{f}.ilike.*{t}*' for f in ('cliente', 'nit', 'email', 'ref_serie'))})"
+                   for t in tokens]
+        rows = supabase_admin.table('despachos').select('id, created_at, cliente, nit, estado') \
+            .or_(f"and({','.join(clauses)})").order('created_at', desc=True).limit(limit).execute().data
+        return [dict(_summary(r), score=0) for r in rows]
+
+    # --- CONSULTA ---
+    def _expand(self, token):
+        """Términos que empiezan por token, el exacto primero."""
+        i = bisect.bisect_left(self._terms, token)
+        out = []
+        while i < len(self._terms) and len(out) < MAX_EXPANSIONS:
+            term = self._terms[i]
+            if not term.startswith(token): break
+            out.append(term)
+            i += 1
+        return out
+
+    def _best(self, doc_id, token, terms):
+        best = 0
+        for term in terms:
+            weight = self._postings[term].get(doc_id, 0) * (2 if term == token else 1)
+            if weight > best: best = weight
+        return best
+
+    def search(self, query, limit=10):
+        """Despachos que contienen todos los términos (como prefijo), por relevancia."""
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens: return []
+        if not self._maybe_build(): return self._fallback(tokens, limit)
+        with self._lock:
+            # Primero el token más selectivo; los demás solo se verifican
+            # contra los candidatos que quedan si eso es más barato
+            expanded = [(token, self._expand(token)) for token in tokens]
+            # Un token sin ningún término (un typo) deja la intersección vacía
+            if not all(terms for _, terms in expanded): return []
+            expanded.sort(key=lambda te: sum(len(self._postings[t]) for t in te[1]))
+            scores = None
+            for token, terms in expanded:
+                if scores is not None and len(scores) * len(terms) < sum(len(self._postings[t]) for t in terms):
+                    scores = {d: s + best for d, s in scores.items()
+                              if (best := self._best(d, token, terms))}
+                else:
+                    # Coincidencia exacta pesa el doble que un prefijo; se
+                    # parte de la lista más larga para no recorrerla a mano
+                    terms = sorted(terms, key=lambda t: len(self._postings[t]), reverse=True)
+                    first = terms[0]
+                    bonus = 2 if first == token else 1
+                    token_scores = {d: w * bonus for d, w in self._postings[first].items()}
+                    for term in terms[1:]:
+                        bonus = 2 if term == token else 1
+                        for doc_id, weight in self._postings[term].items():
+                            s = weight * bonus
+                            if s > token_scores.get(doc_id, 0): token_scores[doc_id] = s
+                    if scores is None:
+                        scores = token_scores
+                    else:
+                        scores = {d: s + token_scores[d] for d, s in scores.items() if d in token_scores}
+                if not scores: return []
+            # Ranking: el umbral sale de los puntajes y solo los empatados en
+            # el umbral se ordenan por fecha. Las listas están en orden de
+            # llegada: recorrerlas al revés deja los recientes primero y el
+            # heap casi nunca se reemplaza
+            # (los puntajes son enteros pequeños: se cuentan en vez de ordenarlos)
+            seen = 0
+            for cutoff, n in sorted(Counter(scores.values()).items(), reverse=True):
+                seen += n
+                if seen >= limit: break
+            above = [d for d, s in scores.items() if s > cutoff]
+            tied = heapq.nlargest(limit - len(above), [d for d, s in reversed(scores.items()) if s == cutoff],
+                                  key=self._created.get)
+            ranked = sorted(above + tied, key=lambda d: (scores[d], self._created[d]), reverse=True)
+            return [dict(self._docs[d], score=scores[d]) for d in ranked]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "despachos": len(self._docs),
+                "terminos": len(self._terms),
+                "construido": self._loaded_at is not None,
+                "build_seconds": round(self.build_seconds, 3),
+            }
+
+
+despachos_index = DespachoIndex(catchup_interval=float(os.getenv('SEARCH_CATCHUP_INTERVAL', 60)))
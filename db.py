@@ -1,18 +1,118 @@
 import os
+import threading
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from metrics import TimedQuery, TimedNamespace
 
 # Cargar variables de entorno
 load_dotenv()
 
-# Credenciales
-url: str = os.getenv('SUPABASE_URL')
-key: str = os.getenv('SUPABASE_KEY')         # ANON KEY
-service_key: str = os.getenv('SUPABASE_SERVICE_KEY') # SERVICE ROLE
+# ==========================================
+#  CLIENTES DE SUPABASE (PEREZOSOS Y COMPARTIDOS)
+# ==========================================
+# Los clientes se crean en el primer uso, no al importar. Así importar un
+# blueprint no exige credenciales ni paga el costo de importar supabase/httpx.
+# Ambos clientes comparten un pool HTTP con keep-alive y timeouts explícitos,
+# y se vuelven a crear en el proceso hijo tras un fork (gunicorn, uwsgi...).
 
-# Crear clientes
-# Cliente normal
-supabase: Client = create_client(url, key)
+HTTP_CONNECT_TIMEOUT = float(os.getenv('SUPABASE_CONNECT_TIMEOUT', 5))
+HTTP_READ_TIMEOUT = float(os.getenv('SUPABASE_READ_TIMEOUT', 15))
+HTTP_POOL_SIZE = int(os.getenv('SUPABASE_POOL_SIZE', 20))
+HTTP_KEEPALIVE = int(os.getenv('SUPABASE_POOL_KEEPALIVE', 10))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv('SUPABASE_KEEPALIVE_EXPIRY', 30))
 
-# Cliente ADMIN (Maestro)
-supabase_admin: Client = create_client(url, service_key)
\ No newline at end of file
+_lock = threading.Lock()
+_clients = {}
+_http = None
+_pid = None
+
+def _reset():
+    """Descarta clientes y pool (los sockets del padre no sirven en el hijo)."""
+    global _http, _pid
+    _clients.clear()
+    _http = None
+    _pid = os.getpid()
+
+def _http_client():
+    global _http
+    if _http is None:
+        import httpx
+        _http = httpx.Client(
+            timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=HTTP_POOL_SIZE,
+                                max_keepalive_connections=HTTP_KEEPALIVE,
+                                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY),
+        )
+    return _http
+
+def _build(key_env):
+    from supabase import create_client
+    try:
+        from supabase import ClientOptions
+    except ImportError:
+        ClientOptions = None
+
+    # Credenciales
+    url = os.getenv('SUPABASE_URL')
+    key = os.getenv(key_env)
+    if not url or not key:
+        raise RuntimeError(f"Faltan SUPABASE_URL o {key_env} en el entorno")
+    if ClientOptions is None:
+        return create_client(url, key)
+    try:
+        # supabase-py reciente acepta un httpx.Client propio (pool compartido)
+        options = ClientOptions(httpx_client=_http_client(), postgrest_client_timeout=HTTP_READ_TIMEOUT)
+    except TypeError:
+        options = ClientOptions(postgrest_client_timeout=HTTP_READ_TIMEOUT)
+    return create_client(url, key, options=options)
+
+def get_client(name):
+    """Devuelve el cliente 'anon' o 'admin', creándolo si hace falta."""
+    if _pid != os.getpid():
+        with _lock:
+            if _pid != os.getpid(): _reset()
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _build('SUPABASE_KEY' if name == 'anon' else 'SUPABASE_SERVICE_KEY')
+                _clients[name] = client
+    return client
+
+def _after_fork():
+    global _lock
+    _lock = threading.Lock()  # el lock pudo quedar tomado por otro hilo del padre
+    _reset()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+class _LazyClient:
+    """Proxy que resuelve el cliente real en cada acceso a atributo.
+
+    Las consultas a tablas y las llamadas de auth se miden (ver metrics.py).
+    """
+
+    def __init__(self, name):
+        self._name = name
+
+    def table(self, table_name):
+        return TimedQuery(get_client(self._name).table(table_name), table_name)
+
+    from_ = table
+
+    @property
+    def auth(self):
+        return TimedNamespace(get_client(self._name).auth, 'auth')
+
+    def __getattr__(self, attr):
+        return getattr(get_client(self._name), attr)
+
+    def __repr__(self):
+        return f"<LazyClient {self._name}>"
+
+# Cliente normal (ANON KEY)
+supabase = _LazyClient('anon')
+
+# Cliente ADMIN (Maestro, SERVICE ROLE)
+supabase_admin = _LazyClient('admin')
@@ -0,0 +1,111 @@
+import os
+import sys
+from collections import Counter
+from db import supabase_admin
+
+# ==========================================
+#  EQUIPOS DE CADA DESPACHO (TABLA HIJA)
+# ==========================================
+# Los equipos de una solicitud ya no viajan como un JSON dentro de la fila de
+# 'despachos': se validan al recibirlos y se escriben en 'despacho_items' (una
+# fila por equipo, en un insert masivo junto con el lote del writer). El padre
+# guarda solo num_items y items_resumen, que es lo que leen el listado, el
+# feed, los rollups y los correos; el detalle se consulta bajo demanda.
+#
+# Tabla despacho_items: id bigserial, despacho_id (FK a despachos, ON DELETE
+# CASCADE), posicion int, marca, modelo, serie, unidad, fondo, instrumento,
+# neto, limite (text), con índice (despacho_id, posicion).
+# Columnas nuevas en despachos: num_items int, items_resumen text.
+
+ITEMS_TABLE = 'despacho_items'
+ITEM_FIELDS = ['marca', 'modelo', 'serie', 'unidad', 'fondo', 'instrumento', 'neto', 'limite']
+MAX_ITEMS = int(os.getenv('DESPACHO_MAX_ITEMS', 500))
+MAX_FIELD_LENGTH = 120
+RESUMEN_GROUPS = 3  # grupos marca/modelo que se nombran en el resumen
+READ_PAGE = 1000    # max-rows habitual de PostgREST
+IN_CHUNK = 200      # ids por filtro in_(): la lista va en la URL
+
+def clean_items(items):
+    """Valida y normaliza los equipos del formulario. Lanza ValueError.
+
+    Las filas completamente vacías se descartan; cada campo se guarda como
+    texto recortado (el formulario los envía así).
+    """
+    if items is None: return []
+    if not isinstance(items, list): raise ValueError("El listado de equipos es inválido")
+    if len(items) > MAX_ITEMS: raise ValueError(f"Máximo {MAX_ITEMS} equipos por solicitud")
+    out = []
+    for n, item in enumerate(items, 1):
+        if not isinstance(item, dict): raise ValueError(f"Equipo {n} inválido")
+        row = {}
+        for field in ITEM_FIELDS:
+            value = item.get(field)
+            if isinstance(value, (dict, list)): raise ValueError(f"Equipo {n}: '{field}' inválido")
+            value = '' if value is None else str(value).strip()
+            if len(value) > MAX_FIELD_LENGTH: raise ValueError(f"Equipo {n}: '{field}' demasiado largo")
+            row[field] = value
+        if any(row.values()): out.append(row)
+    return out
+
+def summarize(items):
+    """Texto corto para el listado: 'Ludlum 44-9 ×3 · Fluke 451 · +4 más'."""
+    groups = Counter(' '.join(filter(None, (i.get('marca'), i.get('modelo')))) or 'Sin referencia'
+                     for i in items)
+    parts = [f"{name} ×{n}" if n > 1 else name for name, n in groups.most_common(RESUMEN_GROUPS)]
+    rest = len(groups) - RESUMEN_GROUPS
+    if rest > 0: parts.append(f"+{rest} más")
+    return ' · '.join(parts)[:200]
+
+def child_rows(despacho_id, items):
+    return [dict(item, despacho_id=despacho_id, posicion=n) for n, item in enumerate(items, 1)]
+
+def fetch_items(despacho_ids, columns="despacho_id, posicion, " + ", ".join(ITEM_FIELDS)):
+    """{despacho_id: [equipos en orden]} para varios despachos, paginado.
+
+    Los ids van en bloques de IN_CHUNK para no pasar el largo máximo de URL.
+    """
+    ids = list(dict.fromkeys(despacho_ids))
+    out = {i: [] for i in ids}
+    if 'despacho_id' not in columns: columns = f"despacho_id, {columns}"
+    for i in range(0, len(ids), IN_CHUNK):
+        chunk = ids[i:i + IN_CHUNK]
+        offset = 0
+        while True:
+            rows = supabase_admin.table(ITEMS_TABLE).select(columns).in_('despacho_id', chunk) \
+                .order('despacho_id').order('posicion').range(offset, offset + READ_PAGE - 1).execute().data
+            for r in rows: out.setdefault(r['despacho_id'], []).append(r)
+            if len(rows) < READ_PAGE: break
+            offset += READ_PAGE
+    return out
+
+# --- MIGRACIÓN DE FILAS ANTIGUAS ---
+def backfill(page=200):
+    """Pasa el JSON 'items' de despachos antiguos a la tabla hija.
+
+    Idempotente: solo toma filas sin num_items y borra antes los equipos que
+    pudiera haber dejado una corrida interrumpida.
+    """
+    moved = 0
+    while True:
+        rows = supabase_admin.table('despachos').select('id, items').is_('num_items', 'null') \
+            .order('id').limit(page).execute().data
+        for r in rows:
+            try: items = clean_items(r.get('items'))
+            except ValueError:
+                # Datos viejos fuera de los límites nuevos: se migran recortados
+                items = [{f: str(i.get(f) or '')[:MAX_FIELD_LENGTH] for f in ITEM_FIELDS}
+                         for i in r.get('items') or [] if isinstance(i, dict)]
+            supabase_admin.table(ITEMS_TABLE).delete().eq('despacho_id', r['id']).execute()
+            if items: supabase_admin.table(ITEMS_TABLE).insert(child_rows(r['id'], items), returning='minimal').execute()
+            supabase_admin.table('despachos').update({
+                "num_items": len(items), "items_resumen": summarize(items), "items": None
+            }).eq('id', r['id']).execute()
+            moved += 1
+        if len(rows) < page: return moved
+
+
+if __name__ == '__main__':
+    # Migración única: python equipos.py backfill
+    if sys.argv[1:] != ['backfill']:
+        sys.exit("Uso: python equipos.py backfill")
+    print(f"{backfill()} despachos migrados a {ITEMS_TABLE}")
@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import threading
+from itertools import islice
+from collections import deque
+from db import supabase_admin
+
+# ==========================================
+#  FEED DE DESPACHOS (SERVER-SENT EVENTS)
+# ==========================================
+# Un solo productor por proceso: api_public_save publica cada alta y un hilo
+# de sondeo de baja frecuencia detecta lo que llegó por otro proceso o los
+# cambios de estado. Cada evento se serializa una vez y queda en un buffer
+# circular acotado; las conexiones solo guardan el id del último evento que
+# enviaron y esperan sobre la misma Condition, así que cada dashboard
+# conectado no cuesta una consulta ni una cola propia.
+#
+# Cada conexión abierta sí ocupa un hilo del worker mientras dura, así que el
+# endpoint necesita workers con hilos (gunicorn --threads N) o asíncronos
+# (gevent). El cupo por defecto es la mitad de WEB_THREADS (hilos por worker,
+# debe coincidir con --threads) para que el resto siga atendiendo peticiones
+# normales; con un worker síncrono (1 hilo) el feed queda apagado y la tabla
+# se actualiza al recargar. Con workers asíncronos, FEED_MAX_CLIENTS fija el
+# cupo a mano. Además cada stream se cierra a los FEED_MAX_STREAM_SECONDS y el
+# navegador reconecta con Last-Event-ID, así un hilo no queda tomado para
+# siempre por una pestaña olvidada.
+
+FEED_COLUMNS = "id, created_at, cliente, nit, email, responsable_medicion, cargo, ref_marca, ref_modelo, ref_serie, estado, num_items, items_resumen"
+_FIELDS = [c.strip() for c in FEED_COLUMNS.split(',')]
+
+def _payload(row):
+    """Misma forma que una fila de /api/despachos."""
+    return {k: row.get(k) for k in _FIELDS}
+
+
+class DespachoFeed:
+    def __init__(self, buffer_size=500, poll_interval=30.0, poll_rows=200, max_clients=0):
+        self.poll_interval = poll_interval
+        self.poll_rows = poll_rows
+        self.max_clients = max_clients
+        # El prefijo cambia en cada arranque: un Last-Event-ID de otro proceso
+        # (u otro reinicio) no se confunde con uno de este
+        self.epoch = f"{int(time.time()):x}{os.getpid():x}"
+        self._buffer = deque(maxlen=buffer_size)  # (seq, frame SSE ya armado)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._known = {}  # id -> estado de las filas recientes (para el sondeo)
+        self._seeded = False
+        self._clients = 0
+        self._poller_pid = None
+
+    # --- PRODUCTOR ---
+    def publish(self, kind, row):
+        """Agrega un evento ('nuevo' o 'actualizado') y despierta a los clientes."""
+        data = json.dumps(_payload(row), ensure_ascii=False, default=str)
+        with self._cond:
+            # Al reinsertar, el orden del dict queda como el de llegada
+            self._known.pop(row.get('id'), None)
+            self._known[row.get('id')] = row.get('estado')
+            if len(self._known) > self.poll_rows * 2: self._prune_known()
+            self._seq += 1
+            frame = f"id: {self.epoch}-{self._seq}\nevent: {kind}\ndata: {data}\n\n"
+            self._buffer.append((self._seq, frame))
+            self._cond.notify_all()
+
+    def poll(self):
+        """Compara las filas más recientes con lo ya publicado."""
+        rows = supabase_admin.table('despachos').select(FEED_COLUMNS) \
+            .order('created_at', desc=True).order('id', desc=True).limit(self.poll_rows).execute().data
+        with self._cond:
+            if not self._seeded:
+                # Primer sondeo: solo se toma la foto, no se avisa nada
+                for r in rows: self._known.setdefault(r['id'], r.get('estado'))
+                self._seeded = True
+                return
+            changes = [r for r in reversed(rows) if self._known.get(r['id'], object()) != r.get('estado')]
+        for r in changes:
+            self.publish('nuevo' if r['id'] not in self._known else 'actualizado', r)
+        with self._cond:
+            if len(self._known) > self.poll_rows * 2: self._prune_known()
+
+    def _prune_known(self):
+        """Deja solo las poll_rows filas publicadas o vistas más recientes."""
+        self._known = dict(islice(self._known.items(), len(self._known) - self.poll_rows, None))
+
+    def _poll_loop(self):
+        while True:
+            if self._clients:
+                try: self.poll()
+                except Exception as e: print(f"Error sondeando despachos para el feed: {e}")
+            time.sleep(self.poll_interval)
+
+    def _ensure_poller(self):
+        if not self.poll_interval or self._poller_pid == os.getpid(): return
+        with self._cond:
+            if self._poller_pid == os.getpid(): return
+            threading.Thread(target=self._poll_loop, name="feed-despachos", daemon=True).start()
+            self._poller_pid = os.getpid()
+
+    # --- CONSUMIDORES ---
+    def cursor(self, last_event_id=None):
+        """Posición inicial: lo siguiente a Last-Event-ID, o solo lo nuevo.
+
+        Devuelve (seq, reset). reset=True si el id no es de este proceso: el
+        cliente debe recargar la tabla completa. Si el id ya salió del
+        buffer, read() avisa lo mismo.
+        """
+        with self._cond:
+            if not last_event_id: return self._seq, False
+            epoch, _, seq = last_event_id.partition('-')
+            if epoch != self.epoch or not seq.isdigit(): return self._seq, True
+            if int(seq) > self._seq: return self._seq, True
+            return int(seq), False
+
+    def read(self, after, timeout):
+        """Frames con seq > after (espera hasta timeout si no hay ninguno)."""
+        with self._cond:
+            if self._seq <= after: self._cond.wait(timeout)
+            if self._seq <= after: return [], after
+            oldest = self._buffer[0][0]
+            if after + 1 < oldest:
+                # El cliente se quedó atrás más de lo que guarda el buffer
+                return [self.reset_frame()], self._seq
+            # Los seq del buffer son consecutivos: se salta directo al siguiente
+            frames = [frame for _, frame in islice(self._buffer, after + 1 - oldest, None)]
+            return frames, self._seq
+
+    def reset_frame(self):
+        """Pide al cliente recargar la tabla; el id lo deja al día."""
+        return f"id: {self.epoch}-{self._seq}\nevent: reset\ndata: {{}}\n\n"
+
+    def connect(self):
+        """Reserva un cupo de conexión (False si se llegó al máximo o no hay cupo)."""
+        if self._clients >= self.max_clients: return False
+        self._ensure_poller()
+        with self._cond:
+            if self._clients >= self.max_clients: return False
+            self._clients += 1
+            return True
+
+    def disconnect(self):
+        with self._cond: self._clients -= 1
+
+    def stats(self):
+        with self._cond:
+            return {"clientes": self._clients, "eventos": self._seq, "buffer": len(self._buffer)}
+
+
+WEB_THREADS = int(os.getenv('WEB_THREADS', 1))
+
+feed = DespachoFeed(
+    buffer_size=int(os.getenv('FEED_BUFFER_SIZE', 500)),
+    poll_interval=float(os.getenv('FEED_POLL_INTERVAL', 30)),
+    poll_rows=int(os.getenv('FEED_POLL_ROWS', 200)),
+    max_clients=int(os.getenv('FEED_MAX_CLIENTS') or WEB_THREADS // 2),
+)
@@ -1,5 +1,9 @@
 import os
-from flask import render_template, session, redirect, url_for
+import time
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from flask import render_template, session, redirect, url_for, g
 from functools import wraps
 from db import supabase_admin # Importamos la conexión desde db.py
 
@@ -11,17 +15,130 @@ def render_page(template_name, **kwargs):
                          supabase_key=os.getenv('SUPABASE_KEY'),
                          **kwargs)
 
-# --- 2. OBTENER PERFIL ---
+# --- 2. CACHÉ DE PERFILES ---
+class TTLCache:
+    """LRU acotado con expiración por entrada. Seguro entre hilos."""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None: del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data), "maxsize": self.maxsize, "ttl": self.ttl,
+                "hits": self.hits, "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0
+            }
+
+profile_cache = TTLCache(
+    maxsize=int(os.getenv('PROFILE_CACHE_SIZE', 1024)),
+    ttl=float(os.getenv('PROFILE_CACHE_TTL', 60))
+)
+
+def fetch_profile(uid):
+    """Consulta el perfil en Supabase pasando por la caché de proceso."""
+    p = profile_cache.get(uid)
+    if p is not None: return p
+    response = supabase_admin.table('profiles').select("*").eq('id', uid).execute()
+    if response.data:
+        p = response.data[0]
+        profile_cache.set(uid, p)
+        return p
+    return None
+
+def invalidate_profile(uid):
+    """Descarta el perfil cacheado tras una escritura (update/delete)."""
+    if not uid: return
+    profile_cache.pop(uid)
+    cached = g.get('_profiles')
+    if cached is not None: cached.pop(uid, None)
+
+# Columna requerida: profiles.updated_at timestamptz not null default now().
+# Las escrituras de perfiles (admin y /api/profile/update) la actualizan y el
+# modo delta de /api/users filtra por ella; el default cubre las altas:
+#   alter table profiles add column updated_at timestamptz not null default now();
+
+class ProfilesVersion:
+    """Versión del directorio de perfiles: sube con cada escritura de admin.
+
+    Invalida la copia serializada de /api/users y guarda los ids borrados
+    (acotados) para que el modo delta (updated_since) pueda reportarlos.
+    Son solo los de este proceso: el delta trae además el total de perfiles
+    y el cliente recarga todo (refresh=1) si no le cuadra con el suyo.
+    """
+
+    def __init__(self, tombstones=1000):
+        self.value = 0
+        self._lock = threading.Lock()
+        self._deleted = deque()  # (datetime, uid)
+        self._max_deleted = tombstones
+        self._horizon = datetime.now(timezone.utc)  # borrados conocidos desde aquí
+
+    def bump(self, deleted_uid=None):
+        with self._lock:
+            self.value += 1
+            if deleted_uid:
+                self._deleted.append((datetime.now(timezone.utc), deleted_uid))
+                if len(self._deleted) > self._max_deleted:
+                    self._horizon = self._deleted.popleft()[0]
+
+    def deleted_since(self, since):
+        """Ids borrados después de 'since', o None si ya no se puede saber."""
+        with self._lock:
+            if since < self._horizon: return None
+            return [uid for ts, uid in self._deleted if ts >= since]
+
+profiles_version = ProfilesVersion()
+
+# --- 3. OBTENER PERFIL ---
 def get_current_profile():
     if 'user_id' not in session: return None
+    uid = session['user_id']
+    # Una sola consulta por request: se guarda en flask.g
+    if '_profiles' not in g: g._profiles = {}
+    if uid in g._profiles: return g._profiles[uid]
     try:
-        response = supabase_admin.table('profiles').select("*").eq('id', session['user_id']).execute()
-        if response.data: return response.data[0]
+        p = fetch_profile(uid)
+        g._profiles[uid] = p
+        return p
     except Exception as e:
         print(f"Error perfil: {e}")
     return None
 
-# --- 3. DECORADORES DE SEGURIDAD ---
+# --- 4. DECORADORES DE SEGURIDAD ---
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -38,4 +155,4 @@ def role_required(allowed_roles):
                 return render_page('base.html', error="Acceso denegado")
             return f(*args, **kwargs)
         return decorated_function
-    return decorator
\ No newline at end of file
+    return decorator
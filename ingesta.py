@@ -0,0 +1,229 @@
+import os
+import time
+import threading
+from db import supabase_admin
+from helpers import TTLCache
+from equipos import ITEMS_TABLE, child_rows
+
+# ==========================================
+#  INGESTA AGRUPADA (GROUP COMMIT) DE DESPACHOS
+# ==========================================
+# Cada envío del formulario público se encola y un único hilo los escribe en
+# 'despachos' como insert masivo cada INGEST_BATCH_SIZE filas o cada
+# INGEST_FLUSH_MS milisegundos. El request espera hasta que su fila quedó
+# escrita (durable) antes de responder al cliente. Las filas hijas (equipos)
+# de todo el lote van en un solo insert masivo más, una vez conocidos los ids.
+# La idempotency key se guarda en la fila (columna idempotency_key, UNIQUE):
+# si un insert masivo falla sin saberse si se aplicó (timeout), antes de
+# reintentar fila por fila se buscan por llave las que ya quedaron escritas.
+
+class IngestTimeout(Exception):
+    """La fila no se confirmó a tiempo (puede escribirse después)."""
+
+
+class _Pending:
+    __slots__ = ('row', 'key', 'children', 'enqueued', 'event', 'result', 'error', 'existed')
+
+    def __init__(self, row, key, children):
+        self.row = row
+        self.key = key
+        self.children = children or []
+        self.enqueued = time.monotonic()
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.existed = False  # la fila ya estaba escrita (no se creó en este envío)
+
+
+class GroupCommitWriter:
+    def __init__(self, table, batch_size=50, flush_ms=20, timeout=10.0, idempotency_ttl=86400,
+                 key_column=None, child_table=None, child_rows=None, child_fk=None, child_chunk=1000):
+        self.table = table
+        self.key_column = key_column
+        self.child_table = child_table
+        self.child_rows = child_rows  # (id_padre, hijos) -> filas a insertar
+        self.child_fk = child_fk
+        self.child_chunk = child_chunk
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self.timeout = timeout
+        self._queue = []
+        self._cond = threading.Condition()
+        self._inflight = {}
+        self._done = TTLCache(maxsize=10000, ttl=idempotency_ttl)
+        self._pid = None
+        self.batches = 0
+        self.rows = 0
+
+    def _ensure_started(self):
+        if self._pid == os.getpid(): return
+        with self._cond:
+            if self._pid == os.getpid(): return
+            # Tras un fork el hilo del padre no existe en el hijo
+            self._queue = []
+            self._inflight = {}
+            threading.Thread(target=self._run, name=f"ingesta-{self.table}", daemon=True).start()
+            self._pid = os.getpid()
+
+    def submit(self, row, key=None, children=None):
+        """Encola la fila (y sus hijas) y espera a que se escriba.
+
+        Devuelve (fila_guardada, creada). Con la misma idempotency key se
+        devuelve la fila ya escrita (o se espera la que está en vuelo) y
+        creada=False, para que el llamador no repita efectos secundarios.
+        """
+        self._ensure_started()
+        if key and self.key_column: row = dict(row, **{self.key_column: key})
+        created = True
+        with self._cond:
+            if key:
+                saved = self._done.get(key)
+                if saved is not None: return saved, False
+                pending = self._inflight.get(key)
+                if pending is not None: created = False
+            if created:
+                pending = _Pending(row, key, children)
+                if key: self._inflight[key] = pending
+                self._queue.append(pending)
+                self._cond.notify()
+        if not pending.event.wait(self.timeout):
+            raise IngestTimeout("La solicitud sigue en proceso, intente de nuevo")
+        if pending.error is not None: raise pending.error
+        return pending.result, created and not pending.existed
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue: self._cond.wait()
+                deadline = self._queue[0].enqueued + self.flush_interval
+                while len(self._queue) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0: break
+                    self._cond.wait(remaining)
+                batch = self._queue[:self.batch_size]
+                del self._queue[:self.batch_size]
+            try:
+                self._write(batch)
+            except Exception as e:
+                print(f"Error en ingesta agrupada: {e}")
+                for p in batch:
+                    if not p.event.is_set():
+                        p.error = e
+                        p.event.set()
+
+    def _write(self, batch):
+        try:
+            res = supabase_admin.table(self.table).insert([p.row for p in batch]).execute()
+            for p, saved in zip(batch, res.data): p.result = saved
+        except Exception as e:
+            # Un insert masivo falla completo: se reintenta fila por fila para
+            # que un registro inválido no tumbe a los demás del lote
+            print(f"Insert masivo falló ({len(batch)} filas), reintentando individual: {e}")
+            self._match_existing(batch)
+            for p in batch:
+                if p.result is not None: continue
+                try: p.result = supabase_admin.table(self.table).insert(p.row).execute().data[0]
+                except Exception as row_error: p.error = row_error
+        if self.child_table: self._write_children(batch)
+        self.batches += 1
+        self.rows += len(batch)
+        with self._cond:
+            for p in batch:
+                if p.key:
+                    self._inflight.pop(p.key, None)
+                    if p.result is not None: self._done.set(p.key, p.result)
+        for p in batch:
+            if p.result is None and p.error is None: p.error = RuntimeError("Insert sin respuesta")
+            p.event.set()
+
+    def _match_existing(self, batch):
+        """Marca las filas del lote que ya existen (por llave) para no duplicarlas."""
+        keys = [p.key for p in batch if p.key]
+        if not self.key_column or not keys: return
+        try:
+            rows = supabase_admin.table(self.table).select('*').in_(self.key_column, keys).execute().data
+        except Exception as e:
+            # Sin verificación el índice UNIQUE rechaza los duplicados en el reintento
+            print(f"No se pudo verificar el lote por llave: {e}")
+            return
+        found = {r.get(self.key_column): r for r in rows}
+        for p in batch:
+            if p.key in found: p.result, p.existed = found[p.key], True
+
+    def _write_children(self, batch):
+        """Inserta las hijas de los padres ya escritos, en bloques por padre.
+
+        Un bloque nunca parte los hijos de un padre: si falla, se reintenta
+        padre por padre y al que no se puede completar se le borra la fila
+        padre y se le devuelve el error (el cliente reintenta con su llave).
+        """
+        stale = [p for p in batch if p.existed and p.result is not None and p.children]
+        if stale:
+            # Padre ya escrito: sus hijas pueden faltar o estar a medias, se reescriben
+            try:
+                supabase_admin.table(self.child_table).delete() \
+                    .in_(self.child_fk, [p.result['id'] for p in stale]).execute()
+            except Exception as e:
+                print(f"Error limpiando {self.child_table} de filas existentes: {e}")
+                for p in stale: p.children = []
+        chunks, chunk, size = [], [], 0
+        for p in batch:
+            if p.result is None or not p.children: continue
+            rows = self.child_rows(p.result['id'], p.children)
+            if chunk and size + len(rows) > self.child_chunk:
+                chunks.append(chunk)
+                chunk, size = [], 0
+            chunk.append((p, rows))
+            size += len(rows)
+        if chunk: chunks.append(chunk)
+        for chunk in chunks:
+            try:
+                # returning=minimal: no hace falta que vuelvan cientos de filas
+                supabase_admin.table(self.child_table).insert(
+                    [r for _, rows in chunk for r in rows], returning='minimal').execute()
+                continue
+            except Exception as e:
+                print(f"Insert masivo de {self.child_table} falló, reintentando por solicitud: {e}")
+            for p, rows in chunk:
+                try: supabase_admin.table(self.child_table).insert(rows, returning='minimal').execute()
+                except Exception as child_error:
+                    try: supabase_admin.table(self.table).delete().eq('id', p.result['id']).execute()
+                    except Exception as e: print(f"Error deshaciendo fila incompleta {p.result['id']}: {e}")
+                    p.result, p.error = None, child_error
+
+
+class RateLimiter:
+    """Ventana fija por llave (IP, NIT...). Seguro entre hilos."""
+
+    def __init__(self, limit, window=60):
+        self.limit = limit
+        self.window = window
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        if not self.limit or not key: return True
+        bucket = int(time.time() // self.window)
+        with self._lock:
+            if len(self._counts) > 10000:
+                self._counts = {k: v for k, v in self._counts.items() if v[0] == bucket}
+            b, n = self._counts.get(key, (bucket, 0))
+            if b != bucket: n = 0
+            if n >= self.limit: return False
+            self._counts[key] = (bucket, n + 1)
+            return True
+
+
+despachos_writer = GroupCommitWriter(
+    'despachos',
+    batch_size=int(os.getenv('INGEST_BATCH_SIZE', 50)),
+    flush_ms=float(os.getenv('INGEST_FLUSH_MS', 20)),
+    timeout=float(os.getenv('INGEST_TIMEOUT', 10)),
+    idempotency_ttl=float(os.getenv('IDEMPOTENCY_TTL', 86400)),
+    key_column='idempotency_key',
+    child_table=ITEMS_TABLE,
+    child_rows=child_rows,
+    child_fk='despacho_id',
+)
+ip_limiter = RateLimiter(int(os.getenv('RATE_LIMIT_IP_PER_MIN', 30)))
+nit_limiter = RateLimiter(int(os.getenv('RATE_LIMIT_NIT_PER_MIN', 10)))
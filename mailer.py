@@ -0,0 +1,305 @@
+import os
+import json
+import time
+import uuid
+import heapq
+import smtplib
+import threading
+from metrics import timed_upstream
+
+# ==========================================
+#  BANDEJA DE SALIDA (OUTBOX) DE CORREOS
+# ==========================================
+# Los correos se guardan primero en disco (spool) y luego un pool de hilos
+# los envía reutilizando una sesión SMTP autenticada. Si el proceso se
+# reinicia, los mensajes pendientes del spool se vuelven a encolar.
+# Con varios workers todos comparten el spool: antes de enviar, cada proceso
+# reclama el archivo renombrándolo a <id>.<pid>.<inicio>.sending (rename
+# atómico), así que un mismo correo no sale una vez por proceso. <inicio> es
+# el arranque del proceso: si un worker muere y otro hereda su pid, los
+# reclamos viejos no se confunden con los del nuevo.
+
+def _alive(pid):
+    try: os.kill(pid, 0)
+    except ProcessLookupError: return False
+    except PermissionError: return True
+    return True
+
+def _start_time(pid):
+    """Arranque del proceso en ticks desde el boot (/proc); None si no se sabe."""
+    try:
+        with open(f'/proc/{pid}/stat') as fh: stat = fh.read()
+    except OSError: return None
+    # El nombre del comando va entre paréntesis y puede traer espacios
+    return stat.rsplit(')', 1)[1].split()[19]
+
+class Outbox:
+    def __init__(self, spool_dir, workers=1, max_attempts=5, backoff=5.0,
+                 max_backoff=600.0, idle_timeout=60.0):
+        self.spool_dir = spool_dir
+        self.failed_dir = os.path.join(spool_dir, 'failed')
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.idle_timeout = idle_timeout
+
+        self._heap = []  # (hora_de_envio, seq, msg_id)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._threads = []
+        self._started = False
+        self._stopping = False
+        self._pid = None
+        self._boot = None  # marca de este proceso en sus reclamos
+
+        self._stats_lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.connects = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.latency_last = 0.0
+
+    # --- CONFIGURACIÓN SMTP (leída al conectar, después de load_dotenv) ---
+    def _smtp_settings(self):
+        return {
+            "server": os.getenv('MAIL_SERVER'),
+            "port": int(os.getenv('MAIL_PORT') or 587),
+            "username": os.getenv('MAIL_USERNAME'),
+            "password": os.getenv('MAIL_PASSWORD'),
+            "use_tls": os.getenv('MAIL_USE_TLS', '1').lower() in ('1', 'true', 'yes'),
+            "timeout": float(os.getenv('MAIL_TIMEOUT', 30)),
+        }
+
+    # --- SPOOL EN DISCO ---
+    def _path(self, msg_id):
+        return os.path.join(self.spool_dir, f"{msg_id}.json")
+
+    def _write(self, record):
+        tmp = self._path(record['id']) + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as fh:
+            json.dump(record, fh)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, self._path(record['id']))
+
+    def _claimed(self, msg_id):
+        return os.path.join(self.spool_dir, f"{msg_id}.{os.getpid()}.{self._boot}.sending")
+
+    def _claim(self, msg_id):
+        """Toma el mensaje para este proceso. False si otro ya lo tomó."""
+        try: os.rename(self._path(msg_id), self._claimed(msg_id))
+        except FileNotFoundError: return False
+        return True
+
+    def _release(self, msg_id):
+        try: os.remove(self._claimed(msg_id))
+        except FileNotFoundError: pass
+
+    def _owner_alive(self, pid, boot):
+        if pid == os.getpid(): return boot == self._boot
+        if not _alive(pid): return False
+        # Sin /proc no se puede distinguir un pid reutilizado: se respeta
+        current = _start_time(pid)
+        return current is None or boot is None or boot == current
+
+    def _recover_claims(self):
+        """Devuelve al spool lo que reclamó un proceso que ya no existe."""
+        for name in os.listdir(self.spool_dir):
+            if not name.endswith('.sending'): continue
+            parts = name.split('.')
+            if len(parts) not in (3, 4) or not parts[1].isdigit(): continue
+            # <id>.<pid>.sending: formato anterior, sin marca de arranque
+            boot = parts[2] if len(parts) == 4 else None
+            if self._owner_alive(int(parts[1]), boot): continue
+            try: os.rename(os.path.join(self.spool_dir, name), self._path(parts[0]))
+            except OSError: pass
+
+    def _read(self, msg_id):
+        with open(self._claimed(msg_id), encoding='utf-8') as fh:
+            return json.load(fh)
+
+    def _schedule(self, msg_id, when):
+        with self._cond:
+            self._seq += 1
+            heapq.heappush(self._heap, (when, self._seq, msg_id))
+            self._cond.notify()
+
+    # --- API PÚBLICA ---
+    def enqueue(self, sender, recipients, message):
+        """Guarda el mensaje en el spool y lo deja listo para envío."""
+        self.start()
+        record = {
+            "id": uuid.uuid4().hex,
+            "sender": sender,
+            "recipients": list(recipients),
+            "raw": message.as_string() if hasattr(message, 'as_string') else message,
+            "attempts": 0,
+            "created": time.time(),
+        }
+        self._write(record)
+        self._schedule(record['id'], time.time())
+        return record['id']
+
+    def start(self):
+        """Arranca los hilos (perezoso) y re-encola lo que quedó en el spool."""
+        if self._started and self._pid == os.getpid(): return
+        with self._cond:
+            if self._started and self._pid == os.getpid(): return
+            # Tras un fork los hilos del padre no existen en el hijo
+            self._heap = []
+            self._threads = []
+            self._stopping = False
+            self._pid = os.getpid()
+            self._boot = _start_time(self._pid) or uuid.uuid4().hex
+            os.makedirs(self.failed_dir, exist_ok=True)
+            self._recover_claims()
+            # Cada proceso agenda todo el spool; el rename decide quién envía
+            for name in sorted(os.listdir(self.spool_dir)):
+                if name.endswith('.json'):
+                    self._seq += 1
+                    heapq.heappush(self._heap, (time.time(), self._seq, name[:-5]))
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"outbox-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            self._started = True
+
+    def stop(self, timeout=5.0):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for t in self._threads: t.join(timeout)
+        self._started = False
+
+    def flush(self, timeout=10.0):
+        """Espera a que la cola quede vacía (útil en pruebas)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.depth() == 0: return True
+            time.sleep(0.05)
+        return False
+
+    def depth(self):
+        return len([n for n in os.listdir(self.spool_dir) if n.endswith(('.json', '.sending'))]) \
+            if os.path.isdir(self.spool_dir) else 0
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "queue_depth": self.depth(),
+                "sent": self.sent,
+                "failed": self.failed,
+                "retries": self.retries,
+                "connects": self.connects,
+                "latency_avg": round(self.latency_total / self.sent, 4) if self.sent else 0.0,
+                "latency_max": round(self.latency_max, 4),
+                "latency_last": round(self.latency_last, 4),
+            }
+
+    # --- WORKERS ---
+    def _next(self, timeout):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not self._stopping:
+                now = time.time()
+                if self._heap and self._heap[0][0] <= now:
+                    return heapq.heappop(self._heap)[2]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0: return None
+                if self._heap: remaining = min(remaining, self._heap[0][0] - now)
+                self._cond.wait(remaining)
+        return None
+
+    def _connect(self):
+        cfg = self._smtp_settings()
+        with timed_upstream('smtp', 'connect', cfg['server']):
+            conn = smtplib.SMTP(cfg['server'], cfg['port'], timeout=cfg['timeout'])
+            if cfg['use_tls']: conn.starttls()
+            if cfg['username'] and cfg['password']: conn.login(cfg['username'], cfg['password'])
+        with self._stats_lock: self.connects += 1
+        return conn
+
+    @staticmethod
+    def _close(conn):
+        if conn is None: return
+        try: conn.quit()
+        except Exception:
+            try: conn.close()
+            except Exception: pass
+
+    def _worker(self):
+        conn = None
+        while not self._stopping:
+            msg_id = self._next(self.idle_timeout)
+            if msg_id is None:
+                # Sesión inactiva: se cierra para no dejar sockets colgados
+                self._close(conn)
+                conn = None
+                continue
+            conn = self._deliver(msg_id, conn)
+        self._close(conn)
+
+    def _deliver(self, msg_id, conn):
+        if not self._claim(msg_id): return conn  # enviado o tomado por otro proceso
+        try:
+            record = self._read(msg_id)
+        except Exception as e:
+            print(f"Outbox: mensaje ilegible {msg_id}: {e}")
+            os.replace(self._claimed(msg_id), os.path.join(self.failed_dir, f"{msg_id}.json"))
+            return conn
+
+        start = time.perf_counter()
+        try:
+            try:
+                if conn is None: conn = self._connect()
+                with timed_upstream('smtp', 'sendmail'):
+                    conn.sendmail(record['sender'], record['recipients'], record['raw'])
+            except smtplib.SMTPServerDisconnected:
+                # La sesión reutilizada expiró: reconectar una vez
+                self._close(conn)
+                conn = self._connect()
+                with timed_upstream('smtp', 'sendmail'):
+                    conn.sendmail(record['sender'], record['recipients'], record['raw'])
+        except Exception as e:
+            self._close(conn)
+            self._retry(record, e)
+            return None
+
+        elapsed = time.perf_counter() - start
+        self._release(msg_id)
+        with self._stats_lock:
+            self.sent += 1
+            self.latency_total += elapsed
+            self.latency_last = elapsed
+            self.latency_max = max(self.latency_max, elapsed)
+        return conn
+
+    def _retry(self, record, error):
+        record['attempts'] += 1
+        record['last_error'] = str(error)
+        if record['attempts'] >= self.max_attempts:
+            print(f"Outbox: se descarta {record['id']} tras {record['attempts']} intentos: {error}")
+            with open(os.path.join(self.failed_dir, f"{record['id']}.json"), 'w', encoding='utf-8') as fh:
+                json.dump(record, fh)
+            self._release(record['id'])
+            with self._stats_lock: self.failed += 1
+            return
+        delay = min(self.backoff * (2 ** (record['attempts'] - 1)), self.max_backoff)
+        print(f"Outbox: reintento {record['attempts']} de {record['id']} en {delay:.0f}s: {error}")
+        # Vuelve al spool como <id>.json: si este proceso muere, otro lo retoma
+        self._write(record)
+        self._release(record['id'])
+        with self._stats_lock: self.retries += 1
+        self._schedule(record['id'], time.time() + delay)
+
+
+outbox = Outbox(
+    spool_dir=os.getenv('MAIL_SPOOL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mail_spool')),
+    workers=int(os.getenv('MAIL_WORKERS', 1)),
+    max_attempts=int(os.getenv('MAIL_MAX_ATTEMPTS', 5)),
+    backoff=float(os.getenv('MAIL_RETRY_BACKOFF', 5)),
+    idle_timeout=float(os.getenv('MAIL_IDLE_TIMEOUT', 60)),
+)
@@ -0,0 +1,179 @@
+import os
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# ==========================================
+#  MÉTRICAS (FORMATO PROMETHEUS)
+# ==========================================
+# Histogramas y contadores en memoria, sin dependencias externas. Registrar
+# una observación es un bisect + incrementos bajo un lock, así que el costo
+# por request es de microsegundos y se puede dejar activo en producción.
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_REQUEST_SECONDS = float(os.getenv('SLOW_REQUEST_MS', 1000)) / 1000
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+_registry = []
+_collectors = []
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _fmt_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for lv, v in sorted(self._values.items()):
+                lines.append(f"{self.name}{_fmt_labels(self.labels, lv)} {v}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [conteos por bucket..., +Inf], suma
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *label_values):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][i] += 1
+            entry[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((lv, (list(c), s)) for lv, (c, s) in self._values.items())
+        for lv, (counts, total) in items:
+            acc = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                acc += n
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labels, lv, [le])} {acc}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labels, lv)} {total}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labels, lv)} {acc}")
+        return lines
+
+def register_collector(fn):
+    """fn() -> lista de (nombre, tipo, ayuda, valor). Se evalúa al exportar."""
+    _collectors.append(fn)
+    return fn
+
+def render_all():
+    lines = []
+    for metric in _registry: lines.extend(metric.render())
+    for fn in _collectors:
+        try:
+            for name, kind, help, value in fn():
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}", f"{name} {value}"]
+        except Exception as e:
+            print(f"Error en collector de métricas: {e}")
+    return '\n'.join(lines) + '\n'
+
+# --- MÉTRICAS DE LA APP ---
+request_seconds = Histogram('sgil_request_duration_seconds', 'Latencia por endpoint', ('endpoint', 'method'))
+request_total = Counter('sgil_requests_total', 'Respuestas por endpoint y status', ('endpoint', 'method', 'status'))
+slow_requests = Counter('sgil_slow_requests_total', 'Requests sobre el umbral SLOW_REQUEST_MS', ('endpoint',))
+upstream_seconds = Histogram('sgil_upstream_duration_seconds', 'Latencia de llamadas a Supabase/SMTP', ('service', 'operation', 'target'))
+upstream_errors = Counter('sgil_upstream_errors_total', 'Errores en llamadas a Supabase/SMTP', ('service', 'operation', 'target'))
+
+@contextmanager
+def timed_upstream(service, operation, target=''):
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        upstream_errors.inc(service, operation, target)
+        raise
+    finally:
+        upstream_seconds.observe(time.perf_counter() - start, service, operation, target)
+
+# --- ENVOLTURAS PARA LOS CLIENTES DE SUPABASE ---
+_WRITE_OPS = frozenset(('insert', 'update', 'upsert', 'delete'))
+
+class TimedQuery:
+    """Envuelve un query builder de postgrest y mide execute() por tabla y operación."""
+    __slots__ = ('_q', '_table', '_op')
+
+    def __init__(self, query, table, op='select'):
+        self._q, self._table, self._op = query, table, op
+
+    def __getattr__(self, name):
+        attr = getattr(self._q, name)
+        if name == 'execute':
+            def execute(*args, **kwargs):
+                with timed_upstream('postgrest', self._op, self._table):
+                    return attr(*args, **kwargs)
+            return execute
+        op = name if name in _WRITE_OPS else self._op
+        if not callable(attr):
+            return TimedQuery(attr, self._table, op) if hasattr(attr, 'execute') else attr
+        def chain(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            return TimedQuery(result, self._table, op) if hasattr(result, 'execute') else result
+        return chain
+
+class TimedNamespace:
+    """Envuelve supabase.auth / auth.admin y mide cada llamada."""
+    __slots__ = ('_obj', '_prefix')
+
+    def __init__(self, obj, prefix):
+        self._obj, self._prefix = obj, prefix
+
+    def __getattr__(self, name):
+        attr = getattr(self._obj, name)
+        if name == 'admin':
+            return TimedNamespace(attr, f"{self._prefix}.admin")
+        if not callable(attr) or name.startswith('_'):
+            return attr
+        def call(*args, **kwargs):
+            with timed_upstream('auth', f"{self._prefix}.{name}"):
+                return attr(*args, **kwargs)
+        return call
+
+# --- MIDDLEWARE FLASK ---
+def init_app(app):
+    from flask import g, request, Response, abort
+
+    @app.before_request
+    def _start_timer():
+        g._metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        start = g.pop('_metrics_start', None)
+        if start is None: return response
+        elapsed = time.perf_counter() - start
+        endpoint = request.endpoint or 'sin_ruta'
+        request_seconds.observe(elapsed, endpoint, request.method)
+        request_total.inc(endpoint, request.method, response.status_code)
+        if elapsed > SLOW_REQUEST_SECONDS:
+            slow_requests.inc(endpoint)
+            print(f"Petición lenta: {request.method} {request.path} -> {response.status_code} en {elapsed * 1000:.0f} ms")
+        return response
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        if METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+            abort(401)
+        return Response(render_all(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from email.mime.text import MIMEText
+from jinja2 import Environment, FileSystemLoader
+from markupsafe import Markup, escape
+from mailer import outbox
+
+try:
+    import fcntl  # Unix: bloqueo del archivo de resumen entre workers
+except ImportError:
+    fcntl = None
+
+# ==========================================
+#  PLANTILLAS DE CORREO PRECOMPILADAS
+# ==========================================
+# Las plantillas se compilan una sola vez al importar el módulo. El "cascarón"
+# estático de cada correo se pre-renderiza y en cada solicitud solo se
+# rellenan los fragmentos variables (cliente, NIT, equipos...).
+
+EMAIL_TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', 'emails')
+LOGO_URL = "https://coordinacionlcd.pythonanywhere.com/static/img/Logo_LCD.png"
+
+_env = Environment(loader=FileSystemLoader(EMAIL_TEMPLATES_DIR), autoescape=True)
+
+_SLOT = '\x00'
+
+class ShellTemplate:
+    """Plantilla pre-renderizada: partes estáticas intercaladas con huecos."""
+
+    def __init__(self, name, slots, safe=(), **static):
+        markers = {k: Markup(f"{_SLOT}{k}{_SLOT}") for k in slots}
+        shell = _env.get_template(name).render(**static, **markers)
+        # Índices pares: HTML estático. Impares: nombre del hueco.
+        self._parts = shell.split(_SLOT)
+        self._safe = frozenset(safe)
+
+    def render(self, **values):
+        out = []
+        for i, part in enumerate(self._parts):
+            if i % 2 == 0:
+                out.append(part)
+            elif part in self._safe:
+                out.append(str(values.get(part, '')))
+            else:
+                out.append(str(escape(values.get(part, ''))))
+        return ''.join(out)
+
+internal_template = ShellTemplate('logistica.html', ('cliente', 'nit', 'num_items'))
+client_template = ShellTemplate('cliente.html', ('responsable_medicion', 'num_items', 'items_html'),
+                                safe=('items_html',), logo_url=LOGO_URL)
+items_fragment = _env.get_template('_items.html')
+digest_template = _env.get_template('logistica_digest.html')
+EMAIL_MAX_ITEMS = int(os.getenv('MAIL_MAX_ITEMS', 50))  # equipos listados en el correo al cliente
+
+def _num_items(data):
+    # El registro guardado ya trae el conteo; si no, se cuenta la lista
+    n = data.get('num_items')
+    return len(data.get('items') or []) if n is None else n
+
+def _html_message(subject, sender, recipients, html):
+    msg = MIMEText(html, 'html', 'utf-8')
+    msg['Subject'] = subject
+    msg['From'] = sender
+    msg['To'] = ", ".join(recipients)
+    return msg
+
+def build_internal_message(data, sender_email, recipients):
+    html = internal_template.render(
+        cliente=data.get('cliente'), nit=data.get('nit'),
+        num_items=_num_items(data))
+    return _html_message(f"🚚 NUEVA RECOLECCIÓN - {data.get('cliente')}",
+                         f"Sievert Sistema <{sender_email}>", recipients, html)
+
+def build_client_message(data, sender_email, client_email):
+    items = data.get('items') or []
+    num_items = _num_items(data)
+    html = client_template.render(
+        responsable_medicion=data.get('responsable_medicion'),
+        num_items=num_items,
+        # Con cientos de equipos el correo solo lista los primeros
+        items_html=items_fragment.render(items=items[:EMAIL_MAX_ITEMS],
+                                         restantes=max(num_items - EMAIL_MAX_ITEMS, 0)))
+    return _html_message("✅ Solicitud Recibida - Sievert LCD",
+                         f"Sievert LCD <{sender_email}>", [client_email], html)
+
+# ==========================================
+#  MODO RESUMEN (DIGEST) PARA LOGÍSTICA
+# ==========================================
+class LogisticsDigest:
+    """Agrupa las notificaciones internas en un correo por ventana de tiempo.
+
+    Las entradas pendientes se guardan en el spool del outbox para que un
+    reinicio no las pierda. Todos los workers comparten ese archivo: cada
+    alta y cada envío lo releen y reescriben bajo un flock, y la ventana se
+    mide desde la primera entrada guardada ('since'), así que da igual qué
+    proceso dispare el envío o cuántos timers haya armados.
+    """
+
+    def __init__(self, window, path):
+        self.window = window
+        self.path = path
+        self._lock = threading.Lock()
+        self._timer = None
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    @contextmanager
+    def _file_lock(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + '.lock', 'a') as fh:
+            if fcntl is not None: fcntl.flock(fh, fcntl.LOCK_EX)
+            try: yield
+            finally:
+                if fcntl is not None: fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as fh:
+                saved = json.load(fh)
+        except (FileNotFoundError, ValueError):
+            saved = {}
+        saved.setdefault('entries', [])
+        return saved
+
+    def _save(self, state):
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as fh:
+            json.dump(state, fh)
+        os.replace(tmp, self.path)
+
+    def _arm(self, delay):
+        # Llamar con self._lock tomado
+        if self._timer is not None: return
+        self._timer = threading.Timer(max(delay, 0), self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def add(self, data, sender_email, recipients):
+        with self._lock, self._file_lock():
+            state = self._load()
+            if not state['entries']: state['since'] = time.time()
+            state['sender'], state['recipients'] = sender_email, list(recipients)
+            state['entries'].append({
+                "cliente": data.get('cliente'), "nit": data.get('nit'),
+                "num_items": _num_items(data)
+            })
+            self._save(state)
+            self._arm(state['since'] + self.window - time.time())
+
+    def flush(self):
+        with self._lock:
+            self._timer = None
+            with self._file_lock():
+                state = self._load()
+                entries = state['entries']
+                if not entries: return
+                remaining = state.get('since', 0) + self.window - time.time()
+                if remaining > 0:
+                    # Otro proceso ya envió y empezó una ventana nueva
+                    self._arm(remaining)
+                    return
+                html = digest_template.render(entries=entries)
+                subject = f"🚚 RESUMEN RECOLECCIONES - {len(entries)} solicitudes"
+                msg = _html_message(subject, f"Sievert Sistema <{state['sender']}>", state['recipients'], html)
+                outbox.enqueue(state['sender'], state['recipients'], msg)
+                self._save({"entries": [], "sender": state['sender'], "recipients": state['recipients']})
+
+    def resume(self):
+        """Re-programa el envío de entradas que quedaron de un proceso anterior."""
+        with self._lock, self._file_lock():
+            state = self._load()
+            if state['entries']: self._arm(state.get('since', 0) + self.window - time.time())
+
+digest = LogisticsDigest(
+    window=float(os.getenv('MAIL_DIGEST_WINDOW', 0)),
+    path=os.path.join(outbox.spool_dir, 'digest', 'pendientes.json'),
+)
@@ -0,0 +1,136 @@
+import os
+import time
+import threading
+from collections import Counter
+from db import supabase_admin
+
+# ==========================================
+#  ROLLUPS DE DESPACHOS (CONTADORES EN MEMORIA)
+# ==========================================
+# Los contadores se actualizan de forma incremental desde api_public_save (y
+# los cambios de estado) y se reconcilian periódicamente con un recorrido
+# completo de la tabla, paginado y con solo las columnas necesarias. El
+# primer recorrido se hace en segundo plano al arrancar el proceso; quien
+# pida el resumen antes de que termine espera hasta ROLLUP_WAIT_SECONDS y, si
+# no alcanza, recibe RollupNotReady en vez de contadores en cero.
+
+RECONCILE_COLUMNS = "id, created_at, estado, cliente, num_items"
+RECONCILE_PAGE = 1000
+
+def _num_items(row):
+    return row.get('num_items') or 0
+
+class RollupNotReady(Exception):
+    """El primer recorrido de la tabla aún no termina."""
+
+class DespachoRollup:
+    def __init__(self, reconcile_interval=300.0, days=30, wait_seconds=10.0):
+        self.reconcile_interval = reconcile_interval
+        self.days = days
+        self.wait_seconds = wait_seconds
+        self._lock = threading.Lock()
+        self._por_estado = Counter()
+        self._por_dia = Counter()
+        self._items_por_cliente = Counter()
+        self._snapshot = None
+        self._loaded_at = None
+        self._reconciling = False
+        self._pending = None  # altas recibidas durante una reconciliación
+        self._ready = threading.Event()
+
+    # --- ACTUALIZACIÓN INCREMENTAL ---
+    def _apply(self, row, sign=1):
+        self._por_estado[row.get('estado') or 'pendiente'] += sign
+        self._por_dia[(row.get('created_at') or '')[:10]] += sign
+        self._items_por_cliente[row.get('cliente') or ''] += sign * _num_items(row)
+
+    def record_new(self, row):
+        """Suma un despacho recién insertado (fila devuelta por el insert)."""
+        with self._lock:
+            if self._loaded_at is None: return
+            self._apply(row)
+            if self._pending is not None: self._pending.append(row)
+            self._snapshot = None
+
+    def record_estado_change(self, old, new):
+        with self._lock:
+            if self._loaded_at is None or old == new: return
+            self._por_estado[old] -= 1
+            self._por_estado[new] += 1
+            self._snapshot = None
+
+    # --- RECONCILIACIÓN COMPLETA ---
+    def reconcile(self):
+        with self._lock:
+            if self._reconciling: return
+            self._reconciling = True
+            self._pending = []
+        try:
+            por_estado, por_dia, items = Counter(), Counter(), Counter()
+            seen = set()
+            cursor = None
+            while True:
+                q = supabase_admin.table('despachos').select(RECONCILE_COLUMNS)
+                if cursor is not None: q = q.gt('id', cursor)
+                rows = q.order('id').limit(RECONCILE_PAGE).execute().data
+                for r in rows:
+                    seen.add(r['id'])
+                    por_estado[r.get('estado') or 'pendiente'] += 1
+                    por_dia[(r.get('created_at') or '')[:10]] += 1
+                    items[r.get('cliente') or ''] += _num_items(r)
+                if len(rows) < RECONCILE_PAGE: break
+                cursor = rows[-1]['id']
+            with self._lock:
+                self._por_estado, self._por_dia, self._items_por_cliente = por_estado, por_dia, items
+                # Altas que llegaron mientras se recorría la tabla y no se vieron
+                for r in self._pending:
+                    if r.get('id') not in seen: self._apply(r)
+                self._loaded_at = time.monotonic()
+                self._snapshot = None
+            self._ready.set()
+        finally:
+            with self._lock:
+                self._reconciling = False
+                self._pending = None
+
+    def start(self):
+        """Recorre la tabla en segundo plano."""
+        threading.Thread(target=self._safe_reconcile, name="rollups-despachos", daemon=True).start()
+
+    def _maybe_reconcile(self):
+        if self._loaded_at is None:
+            # Todavía no hay contadores: se espera al recorrido en curso (o a
+            # uno nuevo si el anterior falló), no se responde con ceros
+            if not self._reconciling: self.start()
+            if not self._ready.wait(self.wait_seconds):
+                raise RollupNotReady("Los indicadores se están calculando, intente en unos segundos")
+        elif time.monotonic() - self._loaded_at > self.reconcile_interval and not self._reconciling:
+            # Stale-while-revalidate: se responde con lo que hay y se refresca aparte
+            self.start()
+
+    def _safe_reconcile(self):
+        try: self.reconcile()
+        except Exception as e: print(f"Error reconciliando rollups: {e}")
+
+    # --- LECTURA ---
+    def summary(self):
+        self._maybe_reconcile()
+        snap = self._snapshot
+        if snap is not None: return snap
+        with self._lock:
+            dias = sorted((d for d in self._por_dia if d), reverse=True)[:self.days]
+            snap = {
+                "solicitudes_pendientes": self._por_estado.get('pendiente', 0),
+                "total_despachos": sum(self._por_estado.values()),
+                "por_estado": {k: v for k, v in self._por_estado.items() if v},
+                "por_dia": {d: self._por_dia[d] for d in sorted(dias)},
+                "items_por_cliente": dict(self._items_por_cliente.most_common()),
+            }
+            self._snapshot = snap
+            return snap
+
+rollup = DespachoRollup(
+    reconcile_interval=float(os.getenv('ROLLUP_RECONCILE_INTERVAL', 300)),
+    days=int(os.getenv('ROLLUP_DAYS', 30)),
+    wait_seconds=float(os.getenv('ROLLUP_WAIT_SECONDS', 10)),
+)
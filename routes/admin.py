@@ -1,6 +1,16 @@
-from flask import Blueprint, request, jsonify
+import os
+import io
+import csv
+import time
+import hashlib
+import threading
+from datetime import datetime, timezone, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Blueprint, request, jsonify, current_app
 from db import supabase, supabase_admin
-from helpers import render_page, login_required, role_required
+from helpers import render_page, login_required, role_required, invalidate_profile, profile_cache, get_current_profile, profiles_version
+from mailer import outbox
+from auth_tokens import verify_latency
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -9,27 +19,129 @@ admin_bp = Blueprint('admin', __name__)
 def gestion_usuarios(): return render_page('gestion_usuarios.html')
 
 # --- APIS DE ADMIN ---
+# El directorio serializado se reutiliza mientras no cambie profiles_version
+# (escrituras de este proceso) y a lo sumo USERS_CACHE_TTL segundos (las de
+# otros procesos). El ETag es el hash del cuerpo: igual en todos los procesos.
+USERS_CACHE_TTL = float(os.getenv('USERS_CACHE_TTL', 60))
+# Margen para el cursor del modo delta (relojes de app y base de datos)
+SYNC_SKEW = timedelta(seconds=5)
+
+_users_snapshot = None
+_users_lock = threading.Lock()
+
+def _get_users_snapshot(refresh=False):
+    global _users_snapshot
+    snap = _users_snapshot
+    if not refresh and snap and snap['version'] == profiles_version.value \
+            and time.monotonic() - snap['at'] < USERS_CACHE_TTL:
+        return snap
+    with _users_lock:
+        snap = _users_snapshot
+        version = profiles_version.value
+        if not refresh and snap and snap['version'] == version and time.monotonic() - snap['at'] < USERS_CACHE_TTL:
+            return snap
+        synced_at = datetime.now(timezone.utc) - SYNC_SKEW
+        res = supabase.table('profiles').select("*").order('full_name').execute()
+        body = current_app.json.dumps(res.data)
+        _users_snapshot = snap = {
+            "version": version, "at": time.monotonic(), "body": body,
+            "etag": hashlib.sha1(body.encode()).hexdigest(), "synced_at": synced_at.isoformat(),
+        }
+        return snap
+
+def _users_delta(since):
+    """Perfiles creados/modificados y borrados después de 'since'.
+
+    'deleted' solo trae los borrados hechos en este proceso; 'total' permite
+    al cliente detectar los de otros workers (le sobran filas) y recargar.
+    """
+    synced_at = datetime.now(timezone.utc) - SYNC_SKEW
+    deleted = profiles_version.deleted_since(since)
+    if deleted is None:
+        # Los borrados de antes ya no se conocen: el cliente debe recargar todo
+        snap = _get_users_snapshot()
+        return {"full": True, "users": current_app.json.loads(snap['body']), "deleted": [],
+                "synced_at": snap['synced_at']}
+    res = supabase.table('profiles').select("*").gt('updated_at', since.isoformat()).order('full_name').execute()
+    total = supabase.table('profiles').select('id', count='exact').limit(1).execute().count
+    return {"full": False, "users": res.data, "deleted": deleted, "total": total,
+            "synced_at": synced_at.isoformat()}
+
 @admin_bp.route('/api/users', methods=['GET'])
 @login_required
 def api_get_users():
+    since = request.args.get('updated_since')
     try:
-        res = supabase.table('profiles').select("*").order('full_name').execute()
-        return jsonify(res.data), 200
+        if since:
+            try:
+                since = datetime.fromisoformat(since)
+                if since.tzinfo is None: since = since.replace(tzinfo=timezone.utc)
+            except ValueError:
+                return jsonify({"error": "updated_since debe ser una fecha ISO 8601"}), 400
+            return jsonify(_users_delta(since)), 200
+        # refresh=1: el cliente detectó borrados que este proceso no conoce
+        snap = _get_users_snapshot(refresh=request.args.get('refresh') == '1')
     except Exception as e: return jsonify({"error": str(e)}), 500
+    # 304 sin re-serializar; no-cache obliga al navegador a revalidar siempre
+    if snap['etag'] in request.if_none_match:
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.response_class(snap['body'], mimetype='application/json')
+    response.set_etag(snap['etag'])
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.headers['X-Synced-At'] = snap['synced_at']
+    response.vary.add('Cookie')
+    return response
+
+# --- OPERACIONES DE USUARIO (compartidas por las APIs individuales y bulk) ---
+MIN_PASSWORD_LENGTH = 6
+
+def _check_password(password):
+    """Misma regla para crear y restablecer, individual o en lote."""
+    if not isinstance(password, str) or len(password) < MIN_PASSWORD_LENGTH:
+        raise ValueError(f"La contraseña debe tener al menos {MIN_PASSWORD_LENGTH} caracteres")
+
+def _create_user(d):
+    _check_password(d.get('password'))
+    attrs = {
+        "email": d.get('email'), "password": d.get('password'), "email_confirm": True,
+        "user_metadata": { "full_name": d.get('full_name'), "role": d.get('role') }
+    }
+    u = supabase_admin.auth.admin.create_user(attrs)
+    profiles_version.bump()
+    return u
+
+def _update_user(d):
+    uid = d.get('user_id')
+    updates = {"updated_at": datetime.now(timezone.utc).isoformat()}
+    if 'full_name' in d: updates['full_name'] = d['full_name']
+    if 'role' in d: updates['role'] = d['role']
+    supabase_admin.table('profiles').update(updates).eq('id', uid).execute()
+    profiles_version.bump()
+    if 'role' in d or 'full_name' in d:
+        meta = {}
+        if 'role' in d: meta['role'] = d['role']
+        if 'full_name' in d: meta['full_name'] = d['full_name']
+        supabase_admin.auth.admin.update_user_by_id(uid, {"user_metadata": meta})
+
+def _delete_user(d):
+    supabase_admin.auth.admin.delete_user(d.get('user_id'))
+    profiles_version.bump(deleted_uid=d.get('user_id'))
+
+def _reset_password(d):
+    _check_password(d.get('new_password'))
+    supabase_admin.auth.admin.update_user_by_id(d.get('user_id'), {"password": d.get('new_password')})
 
 @admin_bp.route('/api/admin/create-user', methods=['POST'])
 @login_required
 @role_required(['administracion', 'coordinacion'])
 def api_create_user():
-    d = request.get_json()
-    if len(d.get('password', '')) < 6:
-        return jsonify({"error": "La contraseña debe tener al menos 6 caracteres"}), 400
+    d = request.get_json(silent=True) or {}
     try:
-        attrs = {
-            "email": d.get('email'), "password": d.get('password'), "email_confirm": True,
-            "user_metadata": { "full_name": d.get('full_name'), "role": d.get('role') }
-        }
-        u = supabase_admin.auth.admin.create_user(attrs)
+        _check_password(d.get('password'))
+    except ValueError as e: return jsonify({"error": str(e)}), 400
+    try:
+        u = _create_user(d)
         return jsonify({"message": "Creado", "user": str(u)}), 200
     except Exception as e: return jsonify({"error": str(e)}), 400
 
@@ -38,17 +150,9 @@ def api_create_user():
 @role_required(['administracion', 'coordinacion'])
 def api_update_user():
     d = request.get_json()
-    uid = d.get('user_id')
-    updates = {}
-    if 'full_name' in d: updates['full_name'] = d['full_name']
-    if 'role' in d: updates['role'] = d['role']
     try:
-        supabase_admin.table('profiles').update(updates).eq('id', uid).execute()
-        if 'role' in d or 'full_name' in d:
-            meta = {}
-            if 'role' in d: meta['role'] = d['role']
-            if 'full_name' in d: meta['full_name'] = d['full_name']
-            supabase_admin.auth.admin.update_user_by_id(uid, {"user_metadata": meta})
+        _update_user(d)
+        invalidate_profile(d.get('user_id'))
         return jsonify({"message": "Actualizado"}), 200
     except Exception as e: return jsonify({"error": str(e)}), 400
 
@@ -58,7 +162,8 @@ def api_update_user():
 def api_delete_user():
     d = request.get_json()
     try:
-        supabase_admin.auth.admin.delete_user(d.get('user_id'))
+        _delete_user(d)
+        invalidate_profile(d.get('user_id'))
         return jsonify({"message": "Eliminado"}), 200
     except Exception as e: return jsonify({"error": str(e)}), 400
 
@@ -66,8 +171,113 @@ def api_delete_user():
 @login_required
 @role_required(['administracion', 'coordinacion'])
 def api_reset_password():
-    d = request.get_json()
+    d = request.get_json(silent=True) or {}
     try:
-        supabase_admin.auth.admin.update_user_by_id(d.get('user_id'), {"password": d.get('new_password')})
+        _check_password(d.get('new_password'))
+    except ValueError as e: return jsonify({"error": str(e)}), 400
+    try:
+        _reset_password(d)
         return jsonify({"message": "Contraseña restablecida"}), 200
-    except Exception as e: return jsonify({"error": str(e)}), 400
\ No newline at end of file
+    except Exception as e: return jsonify({"error": str(e)}), 400
+
+# --- API BULK (LOTES DE OPERACIONES) ---
+BULK_OPS = {
+    'create': _create_user,
+    'update': _update_user,
+    'delete': _delete_user,
+    'reset': _reset_password,
+}
+BULK_MAX_ITEMS = int(os.getenv('BULK_MAX_ITEMS', 500))
+BULK_WORKERS = int(os.getenv('BULK_WORKERS', 8))
+
+# Pool acotado compartido: limita la concurrencia contra la API de Supabase
+_bulk_pool = ThreadPoolExecutor(max_workers=BULK_WORKERS, thread_name_prefix='bulk-users')
+
+def _parse_csv_operations(file_storage):
+    """CSV con encabezados: op (opcional, por defecto create), email, full_name,
+    role, password, user_id, new_password."""
+    text = file_storage.read().decode('utf-8-sig')
+    ops = []
+    for row in csv.DictReader(io.StringIO(text)):
+        row = {k.strip(): (v or '').strip() for k, v in row.items() if k}
+        op = {k: v for k, v in row.items() if v != ''}
+        op['op'] = (op.get('op') or 'create').lower()
+        ops.append(op)
+    return ops
+
+def _run_bulk_item(index, item):
+    op = item.get('op')
+    result = {"index": index, "op": op}
+    try:
+        fn = BULK_OPS.get(op)
+        if fn is None: raise ValueError(f"Operación desconocida: {op}")
+        payload = {k: v for k, v in item.items() if k != 'op'}
+        out = fn(payload)
+        if op == 'create':
+            user = getattr(out, 'user', None)
+            result['user_id'] = getattr(user, 'id', None)
+        else:
+            result['user_id'] = item.get('user_id')
+        result['ok'] = True
+    except Exception as e:
+        result['ok'] = False
+        result['error'] = str(e)
+    return result
+
+@admin_bp.route('/api/admin/bulk-users', methods=['POST'])
+@login_required
+@role_required(['administracion', 'coordinacion'])
+def api_bulk_users():
+    try:
+        if 'file' in request.files:
+            operations = _parse_csv_operations(request.files['file'])
+        else:
+            data = request.get_json(silent=True)
+            if not isinstance(data, dict):
+                return jsonify({"error": "Se esperaba un objeto JSON con 'operations'"}), 400
+            operations = data.get('operations') or []
+    except (UnicodeDecodeError, csv.Error) as e:
+        return jsonify({"error": f"CSV inválido: {e}"}), 400
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"error": "Se requiere una lista de operaciones"}), 400
+    if len(operations) > BULK_MAX_ITEMS:
+        return jsonify({"error": f"Máximo {BULK_MAX_ITEMS} operaciones por lote"}), 400
+
+    # Mismas reglas de rol que las APIs individuales
+    is_admin = (get_current_profile() or {}).get('role') == 'administracion'
+    results = [None] * len(operations)
+    futures = {}
+    for i, item in enumerate(operations):
+        if not isinstance(item, dict):
+            results[i] = {"index": i, "op": None, "ok": False, "error": "Operación inválida"}
+        elif item.get('op') == 'delete' and not is_admin:
+            results[i] = {"index": i, "op": 'delete', "ok": False, "error": "Acceso denegado"}
+        else:
+            futures[_bulk_pool.submit(_run_bulk_item, i, item)] = i
+    for fut in as_completed(futures):
+        results[futures[fut]] = fut.result()
+
+    for r in results:
+        if r['ok'] and r['op'] in ('update', 'delete'): invalidate_profile(r.get('user_id'))
+
+    ok = sum(1 for r in results if r['ok'])
+    status = 200 if ok == len(results) else (207 if ok else 400)
+    return jsonify({"total": len(results), "ok": ok, "failed": len(results) - ok, "results": results}), status
+
+@admin_bp.route('/api/admin/cache-stats', methods=['GET'])
+@login_required
+@role_required(['administracion'])
+def api_cache_stats():
+    return jsonify({"profiles": profile_cache.stats()}), 200
+
+@admin_bp.route('/api/admin/mail-stats', methods=['GET'])
+@login_required
+@role_required(['administracion'])
+def api_mail_stats():
+    return jsonify(outbox.stats()), 200
+
+@admin_bp.route('/api/admin/auth-stats', methods=['GET'])
+@login_required
+@role_required(['administracion'])
+def api_auth_stats():
+    return jsonify({"verify_latency": verify_latency.stats()}), 200
\ No newline at end of file
@@ -0,0 +1,124 @@
+import os
+import time
+from flask import Blueprint, request, jsonify, session
+from helpers import render_page, login_required
+from ambiental import store, parse_ts, parse_value, LEVEL_SECONDS
+
+ambiental_bp = Blueprint('ambiental', __name__)
+
+INGEST_TOKEN = os.getenv('AMBIENTAL_INGEST_TOKEN')
+MAX_BATCH = int(os.getenv('AMBIENTAL_MAX_BATCH', 10000))
+MAX_POINTS = 1500  # puntos por gráfica: define el nivel automático
+
+@ambiental_bp.route('/humedad-temperatura')
+@login_required
+def humedad_temperatura():
+    return render_page('humedad_temperatura.html')
+
+# --- INGESTA (GATEWAYS DE SENSORES) ---
+def _parse_batch(data):
+    """Agrupa el cuerpo por sensor: {sensor: (ts, temp, hum)}.
+
+    Acepta filas {"lecturas": [{"sensor", "ts", "temperatura", "humedad"}]}
+    o columnas de un sensor {"sensor", "ts": [...], "temperatura": [...],
+    "humedad": [...]} (más compacto para lotes grandes).
+    """
+    batches = {}
+    if isinstance(data.get('ts'), list):
+        sensor = str(data.get('sensor') or '').strip()
+        if not sensor: raise ValueError("Falta 'sensor'")
+        n = len(data['ts'])
+        temp = data.get('temperatura') or [None] * n
+        hum = data.get('humedad') or [None] * n
+        if not isinstance(temp, list) or not isinstance(hum, list): raise ValueError("Las columnas deben ser listas")
+        if len(temp) != n or len(hum) != n: raise ValueError("Las columnas deben tener la misma longitud")
+        batches[sensor] = ([parse_ts(t) for t in data['ts']], [parse_value(v) for v in temp], [parse_value(v) for v in hum])
+        return batches
+    rows = data.get('lecturas')
+    if not isinstance(rows, list): raise ValueError("Se requiere 'lecturas' o columnas 'ts'")
+    for r in rows:
+        if not isinstance(r, dict): raise ValueError("Lectura inválida")
+        sensor = str(r.get('sensor') or '').strip()
+        if not sensor: raise ValueError("Falta 'sensor'")
+        ts, temp, hum = batches.setdefault(sensor, ([], [], []))
+        ts.append(parse_ts(r.get('ts')))
+        temp.append(parse_value(r.get('temperatura')))
+        hum.append(parse_value(r.get('humedad')))
+    return batches
+
+@ambiental_bp.route('/api/ambiental/lecturas', methods=['POST'])
+def api_ingest_lecturas():
+    # Los gateways usan un token fijo; un usuario con sesión también puede cargar
+    if INGEST_TOKEN:
+        if request.headers.get('Authorization') != f"Bearer {INGEST_TOKEN}" and 'user_id' not in session:
+            return jsonify({"error": "No autorizado"}), 401
+    elif 'user_id' not in session:
+        return jsonify({"error": "No autorizado"}), 401
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Cuerpo JSON inválido"}), 400
+    # Se rechaza antes de convertir nada
+    lote = data['ts'] if isinstance(data.get('ts'), list) else data.get('lecturas')
+    if not isinstance(lote, list):
+        return jsonify({"error": "Se requiere 'lecturas' o columnas 'ts' (listas)"}), 400
+    if len(lote) > MAX_BATCH:
+        return jsonify({"error": f"Máximo {MAX_BATCH} lecturas por lote"}), 413
+    try:
+        batches = _parse_batch(data)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Lote inválido: {e}"}), 400
+    if any(len(s) > 64 for s in batches):
+        return jsonify({"error": "Identificador de sensor demasiado largo"}), 400
+
+    aceptadas = descartadas = 0
+    try:
+        for sensor, (ts, temp, hum) in batches.items():
+            if not ts: continue
+            ok, bad = store.ingest(sensor, ts, temp, hum)
+            aceptadas += ok
+            descartadas += bad
+    except ValueError as e:
+        return jsonify({"error": str(e), "aceptadas": aceptadas}), 400
+    return jsonify({"aceptadas": aceptadas, "descartadas": descartadas}), 200
+
+# --- CONSULTAS (GRÁFICAS) ---
+@ambiental_bp.route('/api/ambiental/sensores', methods=['GET'])
+@login_required
+def api_sensores():
+    return jsonify({"sensores": store.sensors()}), 200
+
+def _auto_level(desde, hasta):
+    """El nivel más fino que no pase de MAX_POINTS puntos en el rango."""
+    for level, width in sorted(LEVEL_SECONDS.items(), key=lambda kv: kv[1]):
+        if (hasta - desde) / width <= MAX_POINTS: return level
+    return '1d'
+
+@ambiental_bp.route('/api/ambiental/series', methods=['GET'])
+@login_required
+def api_series():
+    sensor = request.args.get('sensor')
+    if not sensor: return jsonify({"error": "Falta 'sensor'"}), 400
+    try:
+        hasta = parse_ts(request.args['hasta']) if request.args.get('hasta') else time.time()
+        desde = parse_ts(request.args['desde']) if request.args.get('desde') else hasta - 86400
+    except ValueError:
+        return jsonify({"error": "desde/hasta deben ser epoch o ISO 8601"}), 400
+    if desde >= hasta: return jsonify({"error": "Rango vacío"}), 400
+    nivel = request.args.get('nivel') or _auto_level(desde, hasta)
+
+    if nivel == 'raw':
+        # Lecturas crudas recientes (solo lo que guarda el buffer en memoria)
+        ts, temp, hum = store.raw(sensor, desde)
+        clean = lambda vs: [None if v != v else round(v, 3) for v in vs]
+        return jsonify({"sensor": sensor, "nivel": nivel, "t": ts, "temperatura": clean(temp), "humedad": clean(hum)}), 200
+    if nivel not in LEVEL_SECONDS:
+        return jsonify({"error": "nivel debe ser raw, 1m, 1h o 1d"}), 400
+    try:
+        rows = store.series(sensor, nivel, desde, hasta)
+    except Exception as e: return jsonify({"error": str(e)}), 500
+    # Formato columnar: menos JSON y directo a la librería de gráficas
+    out = {"sensor": sensor, "nivel": nivel, "t": [r['inicio'] for r in rows]}
+    for col in ('temp_min', 'temp_max', 'temp_mean', 'hum_min', 'hum_max', 'hum_mean'):
+        out[col] = [r.get(col) for r in rows]
+    return jsonify(out), 200
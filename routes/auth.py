@@ -1,6 +1,9 @@
-from flask import Blueprint, session, request, redirect, url_for, jsonify
-from db import supabase, supabase_admin
-from helpers import render_page, login_required, get_current_profile
+import hashlib
+from datetime import datetime, timezone
+from flask import Blueprint, session, request, redirect, url_for, jsonify, current_app
+from db import supabase_admin
+from helpers import render_page, login_required, get_current_profile, invalidate_profile, fetch_profile, profiles_version
+from auth_tokens import verify_access_token
 
 # Definimos el "Blueprint" (El módulo)
 auth_bp = Blueprint('auth', __name__)
@@ -33,28 +36,36 @@ def api_set_session():
     data = request.get_json()
     token = data.get('access_token')
     try:
-        user = supabase.auth.get_user(token)
-        if user:
-            uid = user.user.id
-            session['user_id'] = uid
-            try:
-                prof = supabase_admin.table('profiles').select('*').eq('id', uid).execute()
-                p_data = prof.data[0] if prof.data else {}
-                session['name'] = p_data.get('full_name', 'Usuario')
-                session['role'] = p_data.get('role', 'invitado')
-            except:
-                session['name'] = 'Usuario'
-                session['role'] = 'invitado'
-            return jsonify({"message": "OK"}), 200
+        uid = verify_access_token(token)
     except Exception as e:
+        # InvalidToken o error del servidor de auth (modo remoto)
         return jsonify({"error": str(e)}), 401
-    return jsonify({"error": "Token inválido"}), 401
+    session['user_id'] = uid
+    try:
+        # Misma caché de perfiles que usan role_required y /api/session
+        p_data = fetch_profile(uid) or {}
+        session['name'] = p_data.get('full_name', 'Usuario')
+        session['role'] = p_data.get('role', 'invitado')
+    except:
+        session['name'] = 'Usuario'
+        session['role'] = 'invitado'
+    return jsonify({"message": "OK"}), 200
 
 @auth_bp.route('/api/session', methods=['GET'])
 def api_session():
     p = get_current_profile()
-    if p: return jsonify({"profile": p}), 200
-    return jsonify({"error": "No session"}), 401
+    if not p: return jsonify({"error": "No session"}), 401
+    # main.js la pide en cada página: si el perfil no cambió basta un 304
+    body = current_app.json.dumps({"profile": p})
+    etag = hashlib.sha1(body.encode()).hexdigest()
+    if etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
 
 @auth_bp.route('/api/profile', methods=['GET'])
 @login_required
@@ -67,8 +78,11 @@ def api_profile_update():
     data = request.get_json()
     try:
         supabase_admin.table('profiles').update({
-            "full_name": data.get('full_name')
+            "full_name": data.get('full_name'),
+            "updated_at": datetime.now(timezone.utc).isoformat()
         }).eq('id', session['user_id']).execute()
+        invalidate_profile(session['user_id'])
+        profiles_version.bump()
         session['name'] = data.get('full_name')
         return jsonify({"message": "Perfil actualizado"}), 200
     except Exception as e:
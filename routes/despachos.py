@@ -1,10 +1,29 @@
 import os
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from flask import Blueprint, request, jsonify, render_template
+import io
+import re
+import csv
+import json
+import base64
+import tempfile
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from itertools import islice
+from flask import Blueprint, request, jsonify, render_template, Response, stream_with_context
 from db import supabase_admin, supabase
 from helpers import render_page, login_required
+from mailer import outbox
+from rollups import rollup
+from ingesta import despachos_writer, ip_limiter, nit_limiter, IngestTimeout
+from busqueda import despachos_index
+from eventos import feed
+from equipos import ITEMS_TABLE, ITEM_FIELDS, clean_items, summarize, fetch_items
+from notifications import digest, build_internal_message, build_client_message
+
+try:
+    import openpyxl  # Opcional: solo para exportar a XLSX
+except ImportError:
+    openpyxl = None
 
 despachos_bp = Blueprint('despachos', __name__)
 
@@ -14,55 +33,374 @@ despachos_bp = Blueprint('despachos', __name__)
 def public_form():
     return render_template('solicitud_cliente.html')
 
+# Límites del formulario público: se rechaza antes de parsear el JSON
+MAX_BODY = int(os.getenv('DESPACHO_MAX_BODY', 512 * 1024))
+FIELD_LIMITS = {'cliente': 200, 'nit': 30, 'email': 254, 'responsable_medicion': 200, 'cargo': 120,
+                'ref_marca': 120, 'ref_modelo': 120, 'ref_serie': 120, 'fecha_solicitada': 40,
+                'instrumento_contaminacion': 200}
+IDEMPOTENCY_KEY = re.compile(r'[A-Za-z0-9_-]{1,128}')
+
+def _clean_fields(data):
+    """Campos de texto del encabezado, recortados y con tope de longitud."""
+    out = {}
+    for field, limit in FIELD_LIMITS.items():
+        value = data.get(field)
+        if value is None: continue
+        if isinstance(value, (dict, list)): raise ValueError(f"'{field}' inválido")
+        value = str(value).strip()
+        if len(value) > limit: raise ValueError(f"'{field}' demasiado largo (máx. {limit})")
+        out[field] = value or None
+    return out
+
+def _read_json_limited():
+    """JSON del cuerpo sin leer más de MAX_BODY bytes. None si es inválido.
+
+    Lanza OverflowError si el cuerpo es más grande. Se lee el stream a mano
+    (y no con max_content_length por petición) para cubrir también cuerpos
+    chunked sin Content-Length, con cualquier versión de Flask.
+    """
+    if (request.content_length or 0) > MAX_BODY: raise OverflowError
+    body = request.stream.read(MAX_BODY + 1)
+    if len(body) > MAX_BODY: raise OverflowError
+    try: return json.loads(body) if body else None
+    except ValueError: return None
+
 @despachos_bp.route('/api/public/guardar-despacho', methods=['POST'])
 def api_public_save():
-    data = request.get_json()
+    try:
+        data = _read_json_limited()
+    except OverflowError:
+        return jsonify({"error": "La solicitud es demasiado grande"}), 413
+    if not isinstance(data, dict):
+        return jsonify({"error": "Cuerpo JSON inválido"}), 400
+    try:
+        fields = _clean_fields(data)
+        items = clean_items(data.get('items'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not fields.get('cliente') or not fields.get('nit'):
+        return jsonify({"error": "Cliente y NIT son obligatorios"}), 400
+
+    # La llave va a una columna UNIQUE: formato y largo acotados
+    key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+    if key is not None and not (isinstance(key, str) and IDEMPOTENCY_KEY.fullmatch(key)):
+        return jsonify({"error": "Idempotency-Key inválida (hasta 128 caracteres A-Z, a-z, 0-9, _ o -)"}), 400
+
+    # Límite por IP y por NIT para proteger la tabla, antes de mirar la llave:
+    # una llave ya vista no sirve para saltarse el límite
+    # remote_addr: detrás de un proxy lo corrige ProxyFix (PROXY_FIX_X_FOR en app.py);
+    # X-Forwarded-For directo lo elige el cliente y saltaría el límite
+    if not ip_limiter.allow(request.remote_addr) or not nit_limiter.allow(fields['nit']):
+        return jsonify({"error": "Demasiadas solicitudes, intente en un minuto"}), 429
     try:
         # 1. Guardar en Base de Datos (Sin dirección, ciudad, ni teléfono)
-        supabase_admin.table('despachos').insert({
-            "cliente": data.get('cliente'),
-            "nit": data.get('nit'),
-            "email": data.get('email'),
-            "responsable_medicion": data.get('responsable_medicion'),
-            "cargo": data.get('cargo'),
+        #    El writer agrupa las filas en inserts masivos y responde al quedar escrita;
+        #    los equipos van a la tabla hija y en el padre solo el conteo y el resumen
+        record = {
+            "cliente": fields.get('cliente'),
+            "nit": fields.get('nit'),
+            "email": fields.get('email'),
+            "responsable_medicion": fields.get('responsable_medicion'),
+            "cargo": fields.get('cargo'),
             
             # Dirección, Ciudad y Teléfono eliminados de aquí
             
-            "ref_marca": data.get('ref_marca'),
-            "ref_modelo": data.get('ref_modelo'),
-            "ref_serie": data.get('ref_serie'),
-            "items": data.get('items'),
-            "fecha_solicitada": data.get('fecha_solicitada'),
-            "instrumento_contaminacion": data.get('instrumento_contaminacion'),
+            "ref_marca": fields.get('ref_marca'),
+            "ref_modelo": fields.get('ref_modelo'),
+            "ref_serie": fields.get('ref_serie'),
+            "num_items": len(items),
+            "items_resumen": summarize(items),
+            "fecha_solicitada": fields.get('fecha_solicitada'),
+            "instrumento_contaminacion": fields.get('instrumento_contaminacion'),
             "estado": "pendiente"
-        }).execute()
+        }
+        saved, created = despachos_writer.submit(record, key=key, children=items)
+    except IngestTimeout as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        print(f"Error guardando despacho público: {e}")
+        return jsonify({"error": str(e)}), 400
+
+    # Un reintento con la misma llave no repite correos ni contadores
+    if created:
+        rollup.record_new(saved)
+        despachos_index.add(dict(saved, items=items))
+        feed.publish('nuevo', saved)
 
-        # 2. ENVIAR CORREOS
+        # 2. ENCOLAR CORREOS (los envía el outbox en segundo plano)
         try:
-            send_notification_emails(data)
+            send_notification_emails(dict(record, items=items))
         except Exception as mail_error:
             print(f"Error enviando correos: {mail_error}")
 
-        return jsonify({"message": "Solicitud guardada"}), 200
-
-    except Exception as e:
-        print(f"Error guardando despacho público: {e}")
-        return jsonify({"error": str(e)}), 400
+    return jsonify({"message": "Solicitud guardada", "id": saved.get('id')}), 200
 
 
 # --- RUTAS PRIVADAS (COORDINACIÓN) ---
 
+# Columnas del listado (los equipos se piden aparte)
+LIST_COLUMNS = "id, created_at, cliente, nit, email, responsable_medicion, cargo, ref_marca, ref_modelo, ref_serie, estado, num_items, items_resumen"
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def _encode_cursor(row):
+    raw = json.dumps([row['created_at'], row['id']]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def _decode_cursor(cursor):
+    """(created_at, id) del cursor, validados. Lanza ValueError.
+
+    Ambos valores terminan dentro del filtro or_() de PostgREST, así que solo
+    se acepta una fecha ISO 8601 y un id entero o UUID, ya normalizados.
+    """
+    try:
+        created_at, rid = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError): raise ValueError("cursor inválido")
+    if not isinstance(created_at, str): raise ValueError("cursor inválido")
+    created_at = datetime.fromisoformat(created_at).isoformat()
+    if isinstance(rid, bool) or not isinstance(rid, (int, str)): raise ValueError("cursor inválido")
+    if isinstance(rid, str): rid = str(uuid.UUID(rid))
+    return created_at, rid
+
+def _apply_filters(q, estado=None, desde=None, hasta=None):
+    if estado: q = q.eq('estado', estado)
+    if desde: q = q.gte('created_at', desde.isoformat())
+    if hasta: q = q.lt('created_at', (hasta + timedelta(days=1)).isoformat())
+    return q
+
+def _parse_filters(args):
+    """Lee estado / desde / hasta (YYYY-MM-DD) de la query string."""
+    desde = args.get('desde')
+    hasta = args.get('hasta')
+    return {
+        "estado": args.get('estado') or None,
+        "desde": date.fromisoformat(desde) if desde else None,
+        "hasta": date.fromisoformat(hasta) if hasta else None,
+    }
+
+def _keyset_page(columns, limit, after=None, **filters):
+    """Filas ordenadas por (created_at, id) DESC que siguen a 'after' (created_at, id)."""
+    q = supabase_admin.table('despachos').select(columns)
+    q = _apply_filters(q, **filters)
+    if after:
+        c_at, c_id = after
+        q = q.or_(f'created_at.lt."{c_at}",and(created_at.eq."{c_at}",id.lt.{c_id})')
+    return q.order('created_at', desc=True).order('id', desc=True).limit(limit).execute().data
+
+def iter_despachos(columns, page_size=500, **filters):
+    """Recorre toda la tabla por páginas keyset: memoria constante."""
+    after = None
+    while True:
+        rows = _keyset_page(columns, page_size, after, **filters)
+        yield from rows
+        if len(rows) < page_size: return
+        after = (rows[-1]['created_at'], rows[-1]['id'])
+
+def list_despachos(limit=PAGE_SIZE, cursor=None, **filters):
+    """Página de despachos ordenada por (created_at, id) DESC usando keyset."""
+    after = _decode_cursor(cursor) if cursor else None
+    rows = _keyset_page(LIST_COLUMNS, limit + 1, after, **filters)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = _encode_cursor(rows[-1]) if has_more and rows else None
+    return rows, next_cursor
+
+def count_despachos(**filters):
+    """Conteo exacto sin traer filas."""
+    q = supabase_admin.table('despachos').select('id', count='exact')
+    return _apply_filters(q, **filters).limit(1).execute().count or 0
+
 @despachos_bp.route('/despacho')
 @login_required
 def despacho_dashboard():
     try:
-        response = supabase_admin.table('despachos').select("*").order('created_at', desc=True).execute()
-        solicitudes = response.data
+        solicitudes, next_cursor = list_despachos()
+        pendientes = count_despachos(estado='pendiente')
+        total = count_despachos()
     except Exception as e:
         print(f"Error cargando despachos: {e}")
-        solicitudes = []
+        solicitudes, next_cursor, pendientes, total = [], None, 0, 0
 
-    return render_page('despacho.html', solicitudes=solicitudes)
+    return render_page('despacho.html', solicitudes=solicitudes, next_cursor=next_cursor,
+                       pendientes=pendientes, total=total, feed_activo=feed.max_clients > 0,
+                       xlsx_disponible=openpyxl is not None)
+
+@despachos_bp.route('/api/despachos', methods=['GET'])
+@login_required
+def api_list_despachos():
+    try:
+        filters = _parse_filters(request.args)
+        limit = min(max(int(request.args.get('limit', PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        cursor = request.args.get('cursor') or None
+        if cursor: _decode_cursor(cursor)
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": f"Parámetros inválidos: {e}"}), 400
+    try:
+        rows, next_cursor = list_despachos(limit=limit, cursor=cursor, **filters)
+        return jsonify({"data": rows, "next_cursor": next_cursor}), 200
+    except Exception as e: return jsonify({"error": str(e)}), 500
+
+@despachos_bp.route('/api/despachos/counts', methods=['GET'])
+@login_required
+def api_count_despachos():
+    try:
+        filters = _parse_filters(request.args)
+    except ValueError as e:
+        return jsonify({"error": f"Parámetros inválidos: {e}"}), 400
+    filters.pop('estado')
+    try:
+        return jsonify({
+            "pendientes": count_despachos(estado='pendiente', **filters),
+            "total": count_despachos(**filters)
+        }), 200
+    except Exception as e: return jsonify({"error": str(e)}), 500
+
+# --- FEED EN VIVO (SSE) ---
+FEED_HEARTBEAT = float(os.getenv('FEED_HEARTBEAT', 15))
+FEED_MAX_STREAM_SECONDS = float(os.getenv('FEED_MAX_STREAM_SECONDS', 300))
+
+@despachos_bp.route('/api/despachos/stream', methods=['GET'])
+@login_required
+def api_stream_despachos():
+    if not feed.connect():
+        return jsonify({"error": "Demasiadas conexiones al feed, intente más tarde"}), 503
+    # EventSource reenvía Last-Event-ID solo; el query param sirve al abrir la página
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    after, reset = feed.cursor(last_id)
+
+    def stream():
+        yield f"retry: {int(FEED_HEARTBEAT * 1000)}\n\n"
+        if reset: yield feed.reset_frame()
+        cursor = after
+        # Vida fija: al cerrar, EventSource reconecta y sigue desde su Last-Event-ID
+        deadline = time.monotonic() + FEED_MAX_STREAM_SECONDS
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0: return
+            frames, cursor = feed.read(cursor, min(FEED_HEARTBEAT, remaining))
+            # Comentario SSE: mantiene viva la conexión y detecta clientes caídos
+            yield ''.join(frames) if frames else ': ping\n\n'
+
+    response = Response(stream_with_context(stream()), mimetype='text/event-stream',
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    # Se libera el cupo aunque el cliente se vaya antes del primer evento
+    response.call_on_close(feed.disconnect)
+    return response
+
+SEARCH_LIMIT = 10
+MAX_SEARCH_LIMIT = 50
+
+@despachos_bp.route('/api/despachos/search', methods=['GET'])
+@login_required
+def api_search_despachos():
+    q = (request.args.get('q') or '').strip()
+    try:
+        limit = min(max(int(request.args.get('limit', SEARCH_LIMIT)), 1), MAX_SEARCH_LIMIT)
+    except ValueError:
+        return jsonify({"error": "Parámetros inválidos: limit"}), 400
+    try:
+        return jsonify({"results": despachos_index.search(q, limit)}), 200
+    except Exception as e: return jsonify({"error": str(e)}), 500
+
+# Solo lo que muestra el modal de equipos
+MODAL_ITEM_COLUMNS = "posicion, modelo, serie, unidad, neto, limite"
+
+@despachos_bp.route('/api/despachos/<despacho_id>/items', methods=['GET'])
+@login_required
+def api_despacho_items(despacho_id):
+    try:
+        res = supabase_admin.table('despachos').select('id, num_items').eq('id', despacho_id).execute()
+        if not res.data: return jsonify({"error": "No encontrado"}), 404
+        if not res.data[0].get('num_items'): return jsonify({"items": []}), 200
+        items = supabase_admin.table(ITEMS_TABLE).select(MODAL_ITEM_COLUMNS) \
+            .eq('despacho_id', res.data[0]['id']).order('posicion').execute().data
+        return jsonify({"items": items}), 200
+    except Exception as e: return jsonify({"error": str(e)}), 500
+
+
+# --- EXPORTACIÓN (CSV / XLSX EN STREAMING) ---
+EXPORT_COLUMNS = "id, created_at, cliente, nit, email, responsable_medicion, cargo, ref_marca, ref_modelo, ref_serie, estado, fecha_solicitada, num_items"
+EXPORT_HEADER = ['id', 'fecha', 'cliente', 'nit', 'email', 'responsable_medicion', 'cargo',
+                 'ref_marca', 'ref_modelo', 'ref_serie', 'estado', 'fecha_solicitada',
+                 'item', 'marca', 'modelo', 'serie', 'unidad', 'fondo', 'instrumento', 'neto', 'limite']
+EXPORT_PAGE_SIZE = int(os.getenv('EXPORT_PAGE_SIZE', 500))
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+def _cell(value):
+    """Neutraliza fórmulas: Excel ejecutaría '=HYPERLINK(...)' que escribió un cliente."""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES): return "'" + value
+    return value
+
+def _export_rows(filters):
+    """Una línea por equipo; los despachos sin equipos salen en una sola línea.
+
+    Los equipos se leen de la tabla hija con una consulta por página de
+    despachos (no una por despacho). Los textos salen ya neutralizados
+    (_cell) para ambos formatos.
+    """
+    despachos = iter_despachos(EXPORT_COLUMNS, EXPORT_PAGE_SIZE, **filters)
+    while True:
+        page = list(islice(despachos, EXPORT_PAGE_SIZE))
+        if not page: return
+        items = fetch_items([d['id'] for d in page if d.get('num_items')])
+        for d in page:
+            base = [d.get('id'), d.get('created_at'), d.get('cliente'), d.get('nit'), d.get('email'),
+                    d.get('responsable_medicion'), d.get('cargo'), d.get('ref_marca'), d.get('ref_modelo'),
+                    d.get('ref_serie'), d.get('estado'), d.get('fecha_solicitada')]
+            rows = items.get(d['id']) or []
+            base = [_cell(v) for v in base]
+            if not rows:
+                yield base + [None] * (len(ITEM_FIELDS) + 1)
+            for item in rows:
+                yield base + [item.get('posicion')] + [_cell(item.get(f)) for f in ITEM_FIELDS]
+
+def _csv_stream(filters):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    buf.write('\ufeff')  # BOM para que Excel abra bien las tildes
+    writer.writerow(EXPORT_HEADER)
+    for i, row in enumerate(_export_rows(filters), 1):
+        writer.writerow(row)
+        if i % 200 == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate(0)
+    yield buf.getvalue()
+
+def _xlsx_stream(filters):
+    # openpyxl en modo write-only escribe fila a fila a un archivo temporal
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet('Despachos')
+    ws.append(EXPORT_HEADER)
+    for row in _export_rows(filters):
+        ws.append(row)
+    with tempfile.TemporaryFile() as tmp:
+        wb.save(tmp)
+        tmp.seek(0)
+        while True:
+            chunk = tmp.read(64 * 1024)
+            if not chunk: break
+            yield chunk
+
+@despachos_bp.route('/api/despachos/export', methods=['GET'])
+@login_required
+def api_export_despachos():
+    try:
+        filters = _parse_filters(request.args)
+    except ValueError as e:
+        return jsonify({"error": f"Parámetros inválidos: {e}"}), 400
+    formato = (request.args.get('formato') or 'csv').lower()
+    stamp = date.today().isoformat()
+    if formato == 'xlsx':
+        if openpyxl is None:
+            return jsonify({"error": "Exportación XLSX no disponible (falta openpyxl)"}), 501
+        return Response(stream_with_context(_xlsx_stream(filters)),
+                        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                        headers={"Content-Disposition": f"attachment; filename=despachos_{stamp}.xlsx"})
+    if formato != 'csv':
+        return jsonify({"error": "Formato no soportado (csv o xlsx)"}), 400
+    return Response(stream_with_context(_csv_stream(filters)), mimetype='text/csv; charset=utf-8',
+                    headers={"Content-Disposition": f"attachment; filename=despachos_{stamp}.csv"})
 
 
 # ==========================================
@@ -70,131 +408,24 @@ def despacho_dashboard():
 # ==========================================
 def send_notification_emails(data):
     smtp_server = os.getenv('MAIL_SERVER')
-    smtp_port = os.getenv('MAIL_PORT')
     sender_email = os.getenv('MAIL_USERNAME')
-    sender_password = os.getenv('MAIL_PASSWORD')
     logistics_email = os.getenv('MAIL_LOGISTICS')
 
-    if not all([smtp_server, sender_email, sender_password]):
+    # La contraseña es opcional: sin ella el outbox no hace login (relay local)
+    if not all([smtp_server, sender_email]):
         print("Faltan configuraciones de correo en .env")
         return
 
     # 1. CORREO INTERNO (LOGÍSTICA + DIANA)
-    recipients_internal = [logistics_email, sender_email]
-    
-    msg_internal = MIMEMultipart()
-    msg_internal['Subject'] = f"🚚 NUEVA RECOLECCIÓN - {data.get('cliente')}"
-    msg_internal['From'] = f"Sievert Sistema <{sender_email}>"
-    msg_internal['To'] = ", ".join(recipients_internal)
-
-    # HTML Logística (Solo Cliente, NIT y Cantidad de Equipos - Estilo Tarjeta Elegante)
-    html_internal = f"""
-    <html>
-    <body style="font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; background-color: #f4f7f6; margin: 0; padding: 40px 0;">
-        <div style="max-width: 600px; margin: 0 auto; background: white; border-radius: 12px; overflow: hidden; box-shadow: 0 8px 20px rgba(0,0,0,0.08); border: 1px solid #e0e0e0;">
-            
-            <div style="background-color: #003366; color: white; padding: 30px 20px; text-align: center;">
-                <h2 style="margin: 0; font-size: 24px; font-weight: 600;">⚠️ Solicitud de Recolección</h2>
-                <p style="margin: 8px 0 0 0; font-size: 14px; opacity: 0.8; letter-spacing: 0.5px;">ACCIÓN REQUERIDA - EQUIPO LOGÍSTICO</p>
-            </div>
-
-            <div style="padding: 40px 30px;">
-                
-                <div style="background-color: #ffffff; border: 1px solid #eef1f5; border-radius: 10px; padding: 25px; margin-bottom: 25px; box-shadow: 0 4px 10px rgba(0,0,0,0.03);">
-                    <h3 style="color: #003366; margin-top: 0; margin-bottom: 20px; font-size: 16px; text-transform: uppercase; letter-spacing: 1px; border-bottom: 2px solid #f0f0f0; padding-bottom: 10px;">
-                        📦 Datos Generales
-                    </h3>
-                    <div style="margin-bottom: 12px;">
-                        <span style="display: block; font-size: 12px; color: #888; text-transform: uppercase;">Cliente</span>
-                        <span style="display: block; font-size: 18px; color: #333; font-weight: 600;">{data.get('cliente')}</span>
-                    </div>
-                    <div>
-                        <span style="display: block; font-size: 12px; color: #888; text-transform: uppercase;">NIT</span>
-                        <span style="display: block; font-size: 16px; color: #555;">{data.get('nit')}</span>
-                    </div>
-                </div>
-
-                <div style="background-color: #e8f4fd; color: #0c5460; padding: 20px; border-radius: 10px; text-align: center; border: 1px solid #b8daff;">
-                    <span style="display: block; font-size: 14px; margin-bottom: 5px; font-weight: 600;">TOTAL EQUIPOS A RECOGER</span>
-                    <span style="display: block; font-size: 32px; font-weight: 700; color: #003366;">{len(data.get('items', []))}</span>
-                </div>
-
-            </div>
-            
-            <div style="background-color: #f8f9fa; padding: 15px; text-align: center; font-size: 12px; color: #999; border-top: 1px solid #eee;">
-                Sistema de Gestión Logística - Sievert LCD
-            </div>
-        </div>
-    </body>
-    </html>
-    """
-    msg_internal.attach(MIMEText(html_internal, 'html'))
+    recipients_internal = [e for e in (logistics_email, sender_email) if e]
+    if digest.enabled:
+        digest.add(data, sender_email, recipients_internal)
+    else:
+        outbox.enqueue(sender_email, recipients_internal,
+                       build_internal_message(data, sender_email, recipients_internal))
 
     # 2. CORREO AL CLIENTE
     client_email = data.get('email')
-    
-    with smtplib.SMTP(smtp_server, int(smtp_port)) as server:
-        server.starttls()
-        server.login(sender_email, sender_password)
-        
-        # Enviar Interno
-        server.sendmail(sender_email, recipients_internal, msg_internal.as_string())
-        
-        # Enviar a Cliente
-        if client_email:
-            msg_client = MIMEMultipart()
-            msg_client['Subject'] = f"✅ Solicitud Recibida - Sievert LCD"
-            msg_client['From'] = f"Sievert LCD <{sender_email}>"
-            msg_client['To'] = client_email
-
-            # Link al logo (Asegúrate que este link sea accesible públicamente)
-            logo_url = "https://coordinacionlcd.pythonanywhere.com/static/img/Logo_LCD.png"
-
-            html_client = f"""
-            <html>
-            <body style="font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; background-color: #f4f7f6; margin: 0; padding: 40px 0;">
-                <div style="max-width: 600px; margin: 0 auto; background: white; border-radius: 12px; overflow: hidden; box-shadow: 0 8px 20px rgba(0,0,0,0.08); border: 1px solid #e0e0e0;">
-                    
-                    <div style="text-align: center; padding: 30px 20px; background-color: #ffffff; border-bottom: 1px solid #f0f0f0;">
-                         <img src="{logo_url}" alt="Sievert LCD" style="max-height: 70px; width: auto; display: block; margin: 0 auto;">
-                    </div>
-
-                    <div style="background: linear-gradient(135deg, #52277c 0%, #3a1b59 100%); color: white; padding: 30px 20px; text-align: center;">
-                        <h1 style="margin: 0; font-size: 24px; font-weight: 600;">¡Solicitud Recibida!</h1>
-                        <p style="margin: 10px 0 0 0; font-size: 15px; opacity: 0.9; font-weight: 300;">Hemos registrado su información correctamente.</p>
-                    </div>
-
-                    <div style="padding: 40px 30px;">
-                        <p style="color: #333; font-size: 16px; margin-top: 0;">Hola <strong>{data.get('responsable_medicion')}</strong>,</p>
-                        <p style="color: #555; line-height: 1.6; font-size: 15px;">
-                            Confirmamos que hemos recibido la información técnica y de contaminación para <strong>{len(data.get('items', []))} equipos</strong>.
-                            Nuestro equipo logístico ha sido notificado y procederá con la programación de la recolección.
-                        </p>
-                        
-                        <div style="background-color: #f0fdf4; border: 1px solid #bbf7d0; padding: 20px; border-radius: 10px; margin: 25px 0;">
-                            <strong style="color: #166534; display: block; margin-bottom: 10px; font-size: 14px; text-transform: uppercase; letter-spacing: 0.5px;">📋 Resumen de Equipos Registrados:</strong>
-                            <ul style="margin: 0; padding-left: 20px; color: #14532d; font-size: 14px; line-height: 1.6;">
-                                {''.join([f'<li>{i.get("marca")} {i.get("modelo")} (SN: {i.get("serie")})</li>' for i in data.get('items', [])])}
-                            </ul>
-                        </div>
-
-                        <div style="text-align: center; margin-top: 35px; border-top: 1px solid #f0f0f0; padding-top: 25px;">
-                            <p style="color: #888; font-size: 13px; margin-bottom: 10px;">¿Tienes alguna duda?</p>
-                            <p style="margin: 0; color: #52277c; font-size: 15px;">
-                                Contacta a Coordinación:<br>
-                                <strong style="font-size: 16px; display: block; margin-top: 5px;">Diana Ortegón Pineda</strong>
-                                <span style="font-weight: 600;">(+57) 317 638 8661</span>
-                            </p>
-                        </div>
-                    </div>
-                    
-                    <div style="background-color: #f8f9fa; padding: 20px; text-align: center; font-size: 11px; color: #aaa; border-top: 1px solid #eee;">
-                        &copy; Sievert LCD - Laboratorio de Calibración Dosimétrica<br>
-                        Este es un mensaje automático, por favor no responder.
-                    </div>
-                </div>
-            </body>
-            </html>
-            """
-            msg_client.attach(MIMEText(html_client, 'html'))
-            server.sendmail(sender_email, client_email, msg_client.as_string())
\ No newline at end of file
+    if client_email:
+        outbox.enqueue(sender_email, [client_email],
+                       build_client_message(data, sender_email, client_email))
@@ -1,7 +1,7 @@
 document.addEventListener('DOMContentLoaded', async () => {
     try {
-        // Verificar sesión con el backend
-        const response = await fetch('/api/session');
+        // Verificar sesión con el backend (revalida con ETag: 304 si no cambió)
+        const response = await fetch('/api/session', { cache: 'no-cache' });
         if (!response.ok) {
             if (window.location.pathname !== '/login') window.location.href = '/login';
             return;
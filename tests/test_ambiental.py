@@ -0,0 +1,86 @@
+import os
+import sys
+import math
+import time
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'bench'))
+
+import fake_supabase
+
+
+@pytest.fixture(scope='module')
+def fake():
+    srv, fake = fake_supabase.serve(0, 0, 0, 0, 0)
+    os.environ.update(SUPABASE_URL=f"http://127.0.0.1:{srv.server_address[1]}",
+                      SUPABASE_KEY='k', SUPABASE_SERVICE_KEY='k')
+    yield fake
+    srv.shutdown()
+
+
+@pytest.fixture
+def store(fake):
+    import ambiental
+    fake.db.pop('ambiental_rollups', None)
+    return ambiental.AmbientalStore(flush_interval=1000)
+
+
+class _RpcCaido:
+    """supabase_admin con la función de merge fallando."""
+    def __init__(self, real): self._real = real
+    def __getattr__(self, name): return getattr(self._real, name)
+    def rpc(self, *args, **kwargs): raise RuntimeError("timeout")
+
+
+def _minuto():
+    """Inicio del minuto actual: lecturas en el mismo bucket de cada nivel."""
+    return math.floor(time.time() / 60) * 60
+
+
+def _rollups(fake, nivel):
+    return [r for r in fake.db.get('ambiental_rollups', []) if r['nivel'] == nivel]
+
+
+def test_parse_ts_rechaza_fechas_no_finitas_o_implausibles():
+    from ambiental import parse_ts
+    for value in ('-inf', 'inf', 'nan', -1e11, 1e12, '1970-01-01T00:00:00', True):
+        with pytest.raises(ValueError): parse_ts(value)
+    assert parse_ts('2026-01-01T00:00:00Z') == parse_ts(1767225600)
+
+
+def test_ingest_descarta_fechas_fuera_de_rango(store):
+    now = time.time()
+    assert store.ingest('s', [-1e11, -math.inf, now], [1.0, 2.0, 20.0], [50.0, 50.0, 50.0]) == (1, 2)
+    assert store.raw('s', 0)[0] == [now]
+
+
+def test_flush_que_falla_al_armar_filas_no_pierde_lo_pendiente(store, fake):
+    t0 = _minuto()
+    store.ingest('s', [t0, t0 + 1], [20.0, 22.0], [50.0, 52.0])
+    pendientes = store.stats()['buckets_pendientes']
+    # Un bucket imposible de pasar a ISO hace fallar el armado de filas
+    store._delta[('s', '1m', -1e11)] = [-1e11, 1, 20.0, 20.0, 20.0, 0, 0.0, math.nan, math.nan]
+    with pytest.raises((ValueError, OverflowError, OSError)): store.flush()
+    assert store.stats()['buckets_pendientes'] == pendientes + 1
+    del store._delta[('s', '1m', -1e11)]
+    assert store.flush() == pendientes
+    assert _rollups(fake, '1d')[0]['temp_n'] == 2
+
+
+def test_flush_que_falla_al_enviar_reintenta_el_mismo_lote(store, fake, monkeypatch):
+    import ambiental
+    t0 = _minuto()
+    store.ingest('s', [t0, t0 + 1], [20.0, 22.0], [50.0, 52.0])
+    monkeypatch.setattr(ambiental, 'supabase_admin', _RpcCaido(ambiental.supabase_admin))
+    with pytest.raises(RuntimeError): store.flush()
+    assert store.stats()['buckets_pendientes'] == 3
+    lotes = [lote for lote, _ in store._retry]
+    monkeypatch.undo()
+    store.ingest('s', [t0 + 2], [24.0], [54.0])
+    store.flush()
+    assert [l['id'] for l in fake.db['ambiental_lotes']][-len(lotes) - 1:-1] == lotes
+    dia = _rollups(fake, '1d')[0]
+    assert (dia['temp_n'], dia['temp_min'], dia['temp_max']) == (3, 20.0, 24.0)
+    assert store.stats()['buckets_pendientes'] == 0